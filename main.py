@@ -2,21 +2,50 @@
 MCP Server Template
 """
 import datetime
+import json
+import threading
+import time
 import sys, os
+from typing import Optional
 sys.path.append(os.path.join(os.path.dirname(__file__), "src"))
 from dotenv import load_dotenv
 
+# Before the src imports: their settings are read from the environment at import time
+load_dotenv()
+
+# Server processes sharing port 3000; with more than one, caches, tokens and
+# rate limits go through a shared SQLite store (set before the caches are imported)
+WORKERS = int(os.getenv("MCP_WORKERS", "1"))
+if WORKERS > 1:
+    os.environ.setdefault("MCP_SHARED_STORE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "mcp_shared.db"))
+
 from mcp.server.fastmcp import FastMCP
 from pydantic import Field
+from starlette.requests import Request
+from starlette.responses import Response, JSONResponse
 from tools.methods import ToolsMethods
 from tools.mistral import MistralAI
 from handlers.teams_handler import TeamsHandler
+from handlers.trello_webhook_handler import TrelloWebhookHandler, renewWebhooks, RENEW_INTERVAL
+from handlers.search_index import workspaceIndex
+from connectors.executor import runBlocking, deadline
+from tools.prefetch import prefetcher
+from tools.profiling import profiled
+from tools.result_cache import resultCache, cachedResult, cacheTags, skipResultCache
 
 MistralClient = MistralAI() 
 
+# Default latency budget of a tool call, inherited by every upstream call it makes
+TOOL_BUDGET = float(os.getenv("TOOL_BUDGET_SECONDS", "25"))
+
 mcp = FastMCP("EPISEN_AI_TEAM_SUPPORT", port=3000, stateless_http=True, debug=True)
 
-load_dotenv()
+async def invalidateBoardResults(boardId, *sections):
+    """Drops the cached tool results a write changed; everything if the board is unknown."""
+    if boardId:
+        await runBlocking('store', resultCache.invalidate, *[f"{section}:{boardId}" for section in sections])
+    else:
+        await runBlocking('store', resultCache.clear)
 
 @mcp.tool(
     title="Echo Tool",
@@ -44,205 +73,333 @@ def Greet(User: str = Field(description="The User to greet")) -> str:
 
 @mcp.tool(
     title="Trello Summary",
-    description="Trello Summary tool",
+    description="Trello Summary tool: card counts per list and member, overdue aging, completion ratios, unassigned and undated cards",
 )
-async def trello_summary(project_name: str = Field(description="The name of the project the user want to summarize")) -> str:
+@profiled
+@cachedResult(ttl=60, caseInsensitive=('project_name',))
+async def trello_summary(project_name: str = Field(description="The name of the project the user want to summarize"), include_cards: bool = Field(default=False, description="Also return the raw cards of the board"), budget_seconds: float = Field(default=TOOL_BUDGET, description="Latency budget in seconds, a partial result is returned when it runs out")) -> str:
     """Résumé de l’état des tickets Trello (ToDo, Doing, Done, Blocked)."""
-    boardId = MistralClient.getboardId(project_name)
-    if boardId is None:
-        return "No project found with the given name."
-    else:
-        return ToolsMethods().boardDataForSummary(boardId)
+    with deadline(budget_seconds):
+        try:
+            boardId = await runBlocking('mistral', MistralClient.getboardId, project_name)
+        except Exception as e:
+            # Mistral failed or ran out of budget (its timeout is capped by it): answer instead of failing the tool
+            print(f"Error resolving project name: {e}")
+            skipResultCache()
+            return "The project name could not be resolved in time (Mistral unavailable or latency budget exhausted). Please retry."
+        if boardId is None:
+            skipResultCache()
+            return "No project found with the given name."
+        else:
+            cacheTags(f"cards:{boardId}", f"lists:{boardId}", f"members:{boardId}")
+            return await runBlocking('trello', lambda: ToolsMethods().boardDataForSummary(boardId, include_cards))
     
 @mcp.tool(
     title="Trello Project Overdue Tasks",
     description="Get overdue tasks for a specific Trello project",
 )
-async def trello_project_overdue_tasks(project_name: str = Field(description="The name of the project to get overdue tasks for"), dueDate: datetime = Field(description="The date to check for overdue tasks")) -> str:
-    boardId = MistralClient.getboardId(project_name)
-    if boardId is None:
-        return "No project found with the given name."
-    else:
-        return ToolsMethods().getOverdueTaskWithMembers(boardId, dueDate)
+@profiled
+async def trello_project_overdue_tasks(project_name: str = Field(description="The name of the project to get overdue tasks for"), dueDate: datetime = Field(description="The date to check for overdue tasks"), budget_seconds: float = Field(default=TOOL_BUDGET, description="Latency budget in seconds, a partial result is returned when it runs out")) -> str:
+    with deadline(budget_seconds):
+        try:
+            boardId = await runBlocking('mistral', MistralClient.getboardId, project_name)
+        except Exception as e:
+            print(f"Error resolving project name: {e}")
+            return "The project name could not be resolved in time (Mistral unavailable or latency budget exhausted). Please retry."
+        if boardId is None:
+            return "No project found with the given name."
+        else:
+            return await runBlocking('trello', lambda: ToolsMethods().getOverdueTaskWithMembers(boardId, dueDate))
 
 @mcp.tool(
     title="Add Comment to Trello Task",
     description="Add a comment to a specific Trello Task",
 )
-async def add_comment_to_trello_task(card_id: str = Field(description="The ID of the Trello Task to comment on"), comment_text: str = Field(description="The comment text to add")) -> str:
-    return ToolsMethods().addCommentToCard(card_id, comment_text)
+@profiled
+async def add_comment_to_trello_task(card_id: str = Field(description="The ID of the Trello Task to comment on"), comment_text: str = Field(description="The comment text to add"), budget_seconds: float = Field(default=TOOL_BUDGET, description="Latency budget in seconds for the Trello calls of this write; the tool fails rather than wait longer")) -> str:
+    with deadline(budget_seconds):
+        result = await runBlocking('trello', lambda: ToolsMethods().addCommentToCard(card_id, comment_text))
+        boardId = await runBlocking('trello', lambda: ToolsMethods().getCardBoardId(card_id))
+        await invalidateBoardResults(boardId, "comments")
+        return result
+
+@mcp.tool(
+    title="Trello Board Comments",
+    description="Get the comments of a Trello Board, optionally for one task and/or a date range",
+)
+@profiled
+@cachedResult(ttl=60)
+async def trello_board_comments(board_id: str = Field(description="The ID of the Trello Board to get comments from"), card_id: Optional[str] = Field(default=None, description="Only return comments of this Trello Task"), since: Optional[str] = Field(default=None, description="Only return comments posted after this ISO date"), before: Optional[str] = Field(default=None, description="Only return comments posted before this ISO date"), budget_seconds: float = Field(default=TOOL_BUDGET, description="Latency budget in seconds for the Trello calls of this read; the tool fails rather than wait longer")) -> str:
+    with deadline(budget_seconds):
+        cacheTags(f"comments:{board_id}")
+        return await runBlocking('trello', lambda: ToolsMethods().getBoardComments(board_id, card_id, since, before))
 
 @mcp.tool(
     title="Get Trello Board Members",
     description="Get members of a specific Trello Board",
 )
-async def get_trello_board_members(board_id: str = Field(description="The ID of the Trello Board to get members from")) -> str:
-    return ToolsMethods().getBoardMembers(board_id)
+@profiled
+@cachedResult(ttl=300)
+async def get_trello_board_members(board_id: str = Field(description="The ID of the Trello Board to get members from"), budget_seconds: float = Field(default=TOOL_BUDGET, description="Latency budget in seconds for the Trello calls of this read; the tool fails rather than wait longer")) -> str:
+    with deadline(budget_seconds):
+        cacheTags(f"members:{board_id}")
+        return await runBlocking('trello', lambda: ToolsMethods().getBoardMembers(board_id))
 
 @mcp.tool(
     title="Assign Task to Member",
     description="Assign a Trello Task to a specific member",
 )
-async def assign_task_to_member(card_id: str = Field(description="The ID of the Trello Task to assign"), member_id: str = Field(description="The ID of the member to assign the task to")) -> str:
-    try:
-        return ToolsMethods().assignMemberToTask(card_id, member_id)
-    except Exception as e:
-        print(f"Error assigning member to card: {e}")
-        return None
+@profiled
+async def assign_task_to_member(card_id: str = Field(description="The ID of the Trello Task to assign"), member_id: str = Field(description="The ID of the member to assign the task to"), budget_seconds: float = Field(default=TOOL_BUDGET, description="Latency budget in seconds for the Trello calls of this write; the tool fails rather than wait longer")) -> str:
+    with deadline(budget_seconds):
+        try:
+            result = await runBlocking('trello', lambda: ToolsMethods().assignMemberToTask(card_id, member_id))
+            boardId = await runBlocking('trello', lambda: ToolsMethods().getCardBoardId(card_id))
+            await invalidateBoardResults(boardId, "cards")
+            return result
+        except Exception as e:
+            print(f"Error assigning member to card: {e}")
+            return None
     
 @mcp.tool(
     title="Remove Task from Member",
     description="Remove a Trello Task from a specific member",
 )
-async def remove_task_from_member(card_id: str = Field(description="The ID of the Trello Task to remove"), member_id: str = Field(description="The ID of the member to remove the task from")) -> str:
-    try:
-        return ToolsMethods().removeMemberFromTask(card_id, member_id)
-    except Exception as e:
-        print(f"Error removing member from card: {e}")
-        return None
+@profiled
+async def remove_task_from_member(card_id: str = Field(description="The ID of the Trello Task to remove"), member_id: str = Field(description="The ID of the member to remove the task from"), budget_seconds: float = Field(default=TOOL_BUDGET, description="Latency budget in seconds for the Trello calls of this write; the tool fails rather than wait longer")) -> str:
+    with deadline(budget_seconds):
+        try:
+            result = await runBlocking('trello', lambda: ToolsMethods().removeMemberFromTask(card_id, member_id))
+            boardId = await runBlocking('trello', lambda: ToolsMethods().getCardBoardId(card_id))
+            await invalidateBoardResults(boardId, "cards")
+            return result
+        except Exception as e:
+            print(f"Error removing member from card: {e}")
+            return None
 
 
 @mcp.tool(
     title="Trello Due date from imcompleteTask",
     description="Tell the Due date from imcompleteTask",
 )
-async def trello_Due_date_from_imcompleteTask(project_name: str = Field(description="Get the due dates for all incomplete tasks from a Trello board")) -> str:
-    try:
-        boardId = MistralClient.getboardId(project_name)
-        return ToolsMethods().GetDueDatesfromincompleteTask(boardId)
-    except Exception as e:
-        return "An error occurred while trying to fetch Trello data. The Trello API might be unavailable."
+@profiled
+async def trello_Due_date_from_imcompleteTask(project_name: str = Field(description="Get the due dates for all incomplete tasks from a Trello board"), budget_seconds: float = Field(default=TOOL_BUDGET, description="Latency budget in seconds for the Trello calls of this read; the tool fails rather than wait longer")) -> str:
+    with deadline(budget_seconds):
+        try:
+            boardId = await runBlocking('mistral', MistralClient.getboardId, project_name)
+            return await runBlocking('trello', lambda: ToolsMethods().GetDueDatesfromincompleteTask(boardId))
+        except Exception as e:
+            return "An error occurred while trying to fetch Trello data. The Trello API might be unavailable."
 
 @mcp.tool(
     title="Add New Task to List",
     description="Add a new task to a specific Trello List",
 )
-async def add_new_task_to_list(list_id: str = Field(description="The ID of the Trello List to add the task to"), task_name: str = Field(description="The name of the task to add"), task_desc: str = Field(description="The description of the task to add")) -> str:
-    return ToolsMethods().addNewTaskToList(list_id, task_name, task_desc)
+@profiled
+async def add_new_task_to_list(list_id: str = Field(description="The ID of the Trello List to add the task to"), task_name: str = Field(description="The name of the task to add"), task_desc: str = Field(description="The description of the task to add"), budget_seconds: float = Field(default=TOOL_BUDGET, description="Latency budget in seconds for the Trello calls of this write; the tool fails rather than wait longer")) -> str:
+    with deadline(budget_seconds):
+        result = await runBlocking('trello', lambda: ToolsMethods().addNewTaskToList(list_id, task_name, task_desc))
+        boardId = await runBlocking('trello', lambda: ToolsMethods().getListBoardId(list_id))
+        await invalidateBoardResults(boardId, "cards")
+        return result
 
 @mcp.tool(
     title="Get all Lists",
     description="Get all Lists from Trello Board",
 )
-async def get_all_lists(board_id: str = Field(description="The ID of the Trello Board to get lists from")) -> str:
-    try:
-        return ToolsMethods().getAllBoardLists(board_id)
-    except Exception as e:
-        return "An error occurred while trying to fetch Trello data. The Trello API might be unavailable."
+@profiled
+@cachedResult(ttl=300)
+async def get_all_lists(board_id: str = Field(description="The ID of the Trello Board to get lists from"), budget_seconds: float = Field(default=TOOL_BUDGET, description="Latency budget in seconds for the Trello calls of this read; the tool fails rather than wait longer")) -> str:
+    with deadline(budget_seconds):
+        try:
+            cacheTags(f"lists:{board_id}")
+            return await runBlocking('trello', lambda: ToolsMethods().getAllBoardLists(board_id))
+        except Exception as e:
+            skipResultCache()
+            return "An error occurred while trying to fetch Trello data. The Trello API might be unavailable."
+
+
+@mcp.tool(
+    title="Search Workspace",
+    description="Full-text search over the Trello cards, Trello comments and Teams messages already fetched by the other tools. Returns the best matches with links.",
+)
+@profiled
+async def search_workspace(query: str = Field(description="Words to search for, in French or English"), top_k: int = Field(default=10, description="Maximum number of results"), source: Optional[str] = Field(default=None, description="Restrict to one source: trello_card, trello_comment or teams_message")) -> str:
+    # Served from the in-process index, no upstream call; replaying other workers' changes reads the store
+    hits = await runBlocking('store', workspaceIndex.search, query, top_k, source)
+    return json.dumps({'indexed_documents': len(workspaceIndex), 'hits': hits}, indent=2)
 
 
 @mcp.tool(
     title="Teams Summary",
     description="Get a summary of recent messages and mentions in the main Teams channel.",
 )
-async def teams_summary() -> str:
+@profiled
+async def teams_summary(budget_seconds: float = Field(default=TOOL_BUDGET, description="Latency budget in seconds for the Teams calls of this read; the tool fails rather than wait longer")) -> str:
     """Teams Summary: Number of recent messages and mentions in a given channel."""
-    try:
-        # Initialise le handler qui gère la logique de communication avec Teams
-        handler = TeamsHandler()
+    with deadline(budget_seconds):
+        try:
+            # Le handler (authentification MSAL comprise) tourne dans le pool Teams, hors de la boucle d'événements
+            response = await runBlocking('teams', lambda: TeamsHandler().handleGetChannelMessages())
 
-        # Appelle la méthode pour obtenir les messages du canal
-        # La méthode handleGetChannelMessages gère l'authentification et la requête
-        response = handler.handleGetChannelMessages()
-
-        # Vérifie si la réponse a le format attendu et extrait le contenu
-        if response and 'content' in response and isinstance(response['content'], list) and len(
-                response['content']) > 0:
-            return response['content'][0].get('text', "Erreur : le format de la réponse est incorrect.")
-        else:
-            return "Impossible de récupérer le résumé de Teams (réponse vide)."
+            # Vérifie si la réponse a le format attendu et extrait le contenu
+            if response and 'content' in response and isinstance(response['content'], list) and len(
+                    response['content']) > 0:
+                return response['content'][0].get('text', "Erreur : le format de la réponse est incorrect.")
+            else:
+                return "Impossible de récupérer le résumé de Teams (réponse vide)."
 
-    except Exception as e:
-        print(f"Une erreur s'est produite dans teams_summary: {e}")
-        return f"Désolé, une erreur s'est produite en contactant Teams: {e}."
+        except Exception as e:
+            print(f"Une erreur s'est produite dans teams_summary: {e}")
+            return f"Désolé, une erreur s'est produite en contactant Teams: {e}."
 
 
 @mcp.tool(
     title="Teams Read Thread",
     description="Reads the content of a specific message thread in the main Teams channel, given the parent message ID.",
 )
-async def teams_read_thread(parent_message_id: str) -> str:
+@profiled
+async def teams_read_thread(parent_message_id: str, budget_seconds: float = Field(default=TOOL_BUDGET, description="Latency budget in seconds for the Teams calls of this read; the tool fails rather than wait longer")) -> str:
     """Reads a specific thread."""
-    try:
-        handler = TeamsHandler()
-        response = handler.handleGetThreadMessages(parent_message_id)
-
-        if response and 'content' in response and isinstance(response['content'], list) and len(
-                response['content']) > 0:
-            return response['content'][0].get('text', "Erreur : le format de la réponse est incorrect.")
-        else:
-            return "Impossible de lire le thread de Teams (réponse vide)."
-    except Exception as e:
-        print(f"Une erreur s'est produite lors de la lecture du thread : {e}")
-        return f"Désolé, une erreur s'est produite en contactant Teams : {e}."
+    with deadline(budget_seconds):
+        try:
+            response = await runBlocking('teams', lambda: TeamsHandler().handleGetThreadMessages(parent_message_id))
+
+            if response and 'content' in response and isinstance(response['content'], list) and len(
+                    response['content']) > 0:
+                return response['content'][0].get('text', "Erreur : le format de la réponse est incorrect.")
+            else:
+                return "Impossible de lire le thread de Teams (réponse vide)."
+        except Exception as e:
+            print(f"Une erreur s'est produite lors de la lecture du thread : {e}")
+            return f"Désolé, une erreur s'est produite en contactant Teams : {e}."
 
 @mcp.tool(
     title="Teams List Team Members",
     description="Lists all members of the main Teams team.",
 )
-async def teams_list_members() -> str:
+@profiled
+@cachedResult(ttl=300)
+async def teams_list_members(budget_seconds: float = Field(default=TOOL_BUDGET, description="Latency budget in seconds for the Teams calls of this read; the tool fails rather than wait longer")) -> str:
     """Lists all team members."""
-    try:
-        handler = TeamsHandler()
-        # The handler returns a dictionary.
-        response = handler.handleListTeamMembers()
-
-        # Check if the response is a dictionary with the expected structure
-        if response and 'content' in response and isinstance(response['content'], list) and len(
-                response['content']) > 0:
-            # Extract the 'text' content from the dictionary and return it as a string
-            return response['content'][0].get('text', "Erreur : le format de la réponse est incorrect.")
-        else:
-            return "Impossible de lister les membres de l'équipe (réponse vide ou incorrecte)."
-
-    except Exception as e:
-        print(f"Une erreur s'est produite dans teams_list_members: {e}")
-        return f"Désolé, une erreur s'est produite en contactant Teams: {e}."
+    with deadline(budget_seconds):
+        try:
+            # The handler returns a dictionary.
+            response = await runBlocking('teams', lambda: TeamsHandler().handleListTeamMembers())
+            if not response or response.get('isError'):
+                skipResultCache()
+
+            # Check if the response is a dictionary with the expected structure
+            if response and 'content' in response and isinstance(response['content'], list) and len(
+                    response['content']) > 0:
+                # Extract the 'text' content from the dictionary and return it as a string
+                return response['content'][0].get('text', "Erreur : le format de la réponse est incorrect.")
+            else:
+                return "Impossible de lister les membres de l'équipe (réponse vide ou incorrecte)."
+
+        except Exception as e:
+            print(f"Une erreur s'est produite dans teams_list_members: {e}")
+            return f"Désolé, une erreur s'est produite en contactant Teams: {e}."
 
 
 @mcp.tool(
     title="Teams List All Private Chats",
     description="Lists all your private chat IDs and the display names of the other participants.",
 )
-async def teams_list_private_chats() -> str:
+@profiled
+async def teams_list_private_chats(budget_seconds: float = Field(default=TOOL_BUDGET, description="Latency budget in seconds, a partial result is returned when it runs out")) -> str:
     """Lists all your private chat IDs."""
-    try:
-        handler = TeamsHandler()
-        # Appel de la méthode qui retourne un dictionnaire
-        response = handler.handleListPrivateChats()
-
-        # Vérification du format de la réponse et extraction de la chaîne de caractères
-        if response and 'content' in response and isinstance(response['content'], list) and len(
-                response['content']) > 0:
-            return response['content'][0].get('text', "Erreur : le format de la réponse est incorrect.")
-        else:
-            return "Impossible de lister les discussions privées (réponse vide ou incorrecte)."
-
-    except Exception as e:
-        print(f"Une erreur s'est produite lors de la liste des discussions privées : {e}")
-        return f"Désolé, une erreur s'est produite en contactant Teams : {e}."
+    with deadline(budget_seconds):
+        try:
+            # Appel de la méthode qui retourne un dictionnaire
+            response = await runBlocking('teams', lambda: TeamsHandler().handleListPrivateChats())
+
+            # Vérification du format de la réponse et extraction de la chaîne de caractères
+            if response and 'content' in response and isinstance(response['content'], list) and len(
+                    response['content']) > 0:
+                return response['content'][0].get('text', "Erreur : le format de la réponse est incorrect.")
+            else:
+                return "Impossible de lister les discussions privées (réponse vide ou incorrecte)."
+
+        except Exception as e:
+            print(f"Une erreur s'est produite lors de la liste des discussions privées : {e}")
+            return f"Désolé, une erreur s'est produite en contactant Teams : {e}."
 
 @mcp.tool(
     title="Teams Get Private Chat Messages",
     description="Gets messages from a private chat given its chat ID.",
 )
-async def teams_get_private_messages(chat_id: str) -> str:
+@profiled
+async def teams_get_private_messages(chat_id: str, budget_seconds: float = Field(default=TOOL_BUDGET, description="Latency budget in seconds for the Teams calls of this read; the tool fails rather than wait longer")) -> str:
     """Gets messages from a private chat with a specific chat ID."""
-    try:
-        handler = TeamsHandler()
-        # The handler returns a dictionary. We need to extract the string.
-        response = handler.handleGetPrivateMessages(chat_id)
-
-        # Check if the response is valid and extract the string content
-        if response and 'content' in response and isinstance(response['content'], list) and len(
-                response['content']) > 0:
-            return response['content'][0].get('text', "Erreur : le format de la réponse est incorrect.")
-        else:
-            return "Impossible de récupérer les messages privés (réponse vide ou incorrecte)."
+    with deadline(budget_seconds):
+        try:
+            # The handler returns a dictionary. We need to extract the string.
+            response = await runBlocking('teams', lambda: TeamsHandler().handleGetPrivateMessages(chat_id))
+
+            # Check if the response is valid and extract the string content
+            if response and 'content' in response and isinstance(response['content'], list) and len(
+                    response['content']) > 0:
+                return response['content'][0].get('text', "Erreur : le format de la réponse est incorrect.")
+            else:
+                return "Impossible de récupérer les messages privés (réponse vide ou incorrecte)."
+
+        except Exception as e:
+            print(f"Une erreur s'est produite lors de la lecture des messages privés : {e}")
+            return f"Désolé, une erreur s'est produite en contactant Teams : {e}."
+
+@mcp.custom_route("/trello/webhook", methods=["HEAD", "GET", "POST"])
+async def trello_webhook(request: Request) -> Response:
+    """Trello webhook callback: applies board events to the cached board state."""
+    # Trello checks the callback URL with a HEAD request before creating the webhook
+    if request.method != "POST":
+        return Response(status_code=200)
+
+    handler = TrelloWebhookHandler()
+    body = await request.body()
+    if not handler.verifySignature(body, request.headers.get("x-trello-webhook")):
+        return Response(status_code=401)
 
-    except Exception as e:
-        print(f"Une erreur s'est produite lors de la lecture des messages privés : {e}")
-        return f"Désolé, une erreur s'est produite en contactant Teams : {e}."
+    try:
+        payload = json.loads(body)
+        # Patches the shared store (SQLite with several workers), so off the event loop
+        await runBlocking('store', handler.handleEvent, payload)
+        # Someone changed the board outside this server: its cached tool results are stale
+        boardId = (((payload.get('action') or {}).get('data') or {}).get('board') or {}).get('id')
+        if boardId:
+            await invalidateBoardResults(boardId, "cards", "lists", "members", "comments")
+    except ValueError as e:
+        print(f"Invalid Trello webhook payload: {e}")
+        return Response(status_code=400)
+    return Response(status_code=200)
+
+@mcp.custom_route("/prefetch/stats", methods=["GET"])
+async def prefetch_stats(request: Request) -> Response:
+    """Prefetch hit rate, to tune the warm-up and speculation heuristics."""
+    return JSONResponse(await runBlocking('store', prefetcher.stats))
+
+def create_app():
+    """ASGI app of one server worker, used when MCP_WORKERS > 1."""
+    return mcp.streamable_http_app()
+
+def upkeep():
+    """
+    Renouvelle les webhooks Trello (en resynchronisant tous les tableaux suivis au démarrage),
+    précharge tableaux, annuaires et jeton Graph, puis revérifie les webhooks à intervalle régulier.
+    Tourne dans le seul processus principal : avec plusieurs workers, le résultat est dans le magasin partagé.
+    """
+    resync = renewWebhooks(resync=True) is None
+    prefetcher.warmUp()
+    while True:
+        time.sleep(RENEW_INTERVAL)
+        renewed = renewWebhooks(resync)
+        resync = resync and renewed is None
 
 if __name__ == "__main__":
-    mcp.run(transport="streamable-http")
+    threading.Thread(target=upkeep, daemon=True).start()
+    if WORKERS > 1:
+        import uvicorn
+        uvicorn.run("main:create_app", factory=True, workers=WORKERS, host=mcp.settings.host, port=mcp.settings.port,
+                    app_dir=os.path.dirname(os.path.abspath(__file__)), log_level=mcp.settings.log_level.lower())
+    else:
+        mcp.run(transport="streamable-http")
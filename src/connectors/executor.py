@@ -0,0 +1,154 @@
+# Runs blocking upstream calls (requests, MSAL, Mistral) off the event loop
+
+import os
+import time
+import asyncio
+import itertools
+import threading
+import contextlib
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+# Connect / read timeouts applied to every upstream HTTP call, in seconds
+CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("UPSTREAM_READ_TIMEOUT", "30"))
+
+# One bounded pool per upstream, so a stalled service cannot starve the others
+POOL_SIZES = {
+    'trello': int(os.getenv("TRELLO_WORKERS", "8")),
+    'teams': int(os.getenv("TEAMS_WORKERS", "8")),
+    'mistral': int(os.getenv("MISTRAL_WORKERS", "4")),
+    'prefetch': int(os.getenv("PREFETCH_WORKERS", "2")),
+    # Shared store reads/writes (SQLite with several workers) made from async code
+    'store': int(os.getenv("STORE_WORKERS", "4")),
+}
+
+_pools = {}
+_poolsLock = threading.Lock()
+_jobHooks = []
+_cancelEvent = contextvars.ContextVar('cancel_event', default=None)
+_deadline = contextvars.ContextVar('deadline', default=None)
+_call = contextvars.ContextVar('call', default=None)
+_callIds = itertools.count(1)
+
+
+class WorkCancelled(BaseException):
+    """
+    Raised inside a worker thread once the calling tool has been cancelled.
+    Like asyncio.CancelledError it is not an Exception, so the handlers'
+    catch-all blocks let it through instead of carrying on with the next call.
+    """
+
+
+class DeadlineExceeded(Exception):
+    """Raised before an upstream call when the tool's latency budget is already spent."""
+
+
+def _getPool(name):
+    with _poolsLock:
+        pool = _pools.get(name)
+        if pool is None:
+            pool = ThreadPoolExecutor(max_workers=POOL_SIZES.get(name, 4), thread_name_prefix=f"{name}-worker")
+            _pools[name] = pool
+        return pool
+
+
+def checkCancelled():
+    """Stops the current blocking job between upstream calls if its caller went away."""
+    event = _cancelEvent.get()
+    if event is not None and event.is_set():
+        raise WorkCancelled("The calling tool was cancelled.")
+
+
+@contextlib.contextmanager
+def deadline(seconds, call=None):
+    """
+    Gives the enclosed work a latency budget. Nested budgets never extend the
+    outer one, and blocking jobs started with runBlocking() inherit it.
+    The outermost budget also identifies the tool call the work is done for;
+    background work started for a call passes that id as `call`.
+    """
+    limit = time.monotonic() + seconds if seconds and seconds > 0 else None
+    outer = _deadline.get()
+    if outer is not None and (limit is None or outer < limit):
+        limit = outer
+    token = _deadline.set(limit)
+    callToken = None
+    if call is not None or _call.get() is None:
+        callToken = _call.set(call or f"{os.getpid()}-{next(_callIds)}")
+    try:
+        yield
+    finally:
+        if callToken is not None:
+            _call.reset(callToken)
+        _deadline.reset(token)
+
+
+def currentCall():
+    """Id of the tool call the current work is done for, or None outside any budget."""
+    return _call.get()
+
+
+def remainingTime():
+    """Seconds left in the current budget, or None when there is no budget."""
+    limit = _deadline.get()
+    if limit is None:
+        return None
+    return max(0.0, limit - time.monotonic())
+
+
+def deadlineExpired():
+    remaining = remainingTime()
+    return remaining is not None and remaining <= 0
+
+
+def httpTimeout():
+    """Connect/read timeouts for the next upstream call, capped by the remaining budget."""
+    remaining = remainingTime()
+    if remaining is None:
+        return (CONNECT_TIMEOUT, READ_TIMEOUT)
+    if remaining <= 0:
+        raise DeadlineExceeded("Latency budget exhausted before the upstream call.")
+    return (min(CONNECT_TIMEOUT, remaining), min(READ_TIMEOUT, remaining))
+
+
+def addJobHook(hook):
+    """
+    Registers a callable returning a context manager entered around every
+    blocking job, on its worker thread and inside the caller's context.
+    """
+    if hook not in _jobHooks:
+        _jobHooks.append(hook)
+
+
+def _runJob(func, args, kwargs):
+    if not _jobHooks:
+        return func(*args, **kwargs)
+    with contextlib.ExitStack() as stack:
+        for hook in _jobHooks:
+            stack.enter_context(hook())
+        return func(*args, **kwargs)
+
+
+async def runBlocking(pool_name, func, *args, **kwargs):
+    """
+    Runs func on the pool of the given upstream and awaits its result.
+    If the awaiting task is cancelled (client disconnect), the worker is told
+    to stop at its next checkCancelled().
+    """
+    loop = asyncio.get_running_loop()
+    event = threading.Event()
+    context = contextvars.copy_context()
+    context.run(_cancelEvent.set, event)
+
+    future = loop.run_in_executor(_getPool(pool_name), lambda: context.run(_runJob, func, args, kwargs))
+    try:
+        return await future
+    except asyncio.CancelledError:
+        event.set()
+        raise
+
+
+def submitBackground(pool_name, func, *args, **kwargs):
+    """Starts func on the given pool without waiting for it (warm-up, prefetch)."""
+    return _getPool(pool_name).submit(func, *args, **kwargs)
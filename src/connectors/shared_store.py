@@ -0,0 +1,308 @@
+# Key/value state shared by the caches: in memory for one process, SQLite (WAL) across workers
+
+import os
+import json
+import time
+import sqlite3
+import threading
+import contextlib
+from connectors.executor import checkCancelled, remainingTime, deadlineExpired, DeadlineExceeded
+
+# Path of the SQLite file shared by the server workers; unset means a single process
+SHARED_STORE_PATH = os.getenv("MCP_SHARED_STORE")
+# Expired values are filtered on read and deleted at most this often (seconds)
+PURGE_INTERVAL = float(os.getenv("MCP_SHARED_STORE_PURGE_SECONDS", "60"))
+
+
+class MemoryStore:
+    """Single-process store: values are live Python objects guarded by one lock."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._data = {}
+        # Item ids written through putItems, by group, so items() does not scan every key
+        self._groups = {}
+        self._purgedAt = time.time()
+
+    @contextlib.contextmanager
+    def transaction(self, key, default=dict, ttl=None):
+        """Yields the value of key (created from default) for in-place changes, saved on exit."""
+        with self._lock:
+            value, expires = self._data.get(key, (None, None))
+            if value is None or (expires is not None and time.time() > expires):
+                value = default()
+            self._data[key] = (value, time.time() + ttl if ttl else None)
+            yield value
+
+    @contextlib.contextmanager
+    def view(self, key):
+        """Yields the current value of key (or None) for reading only."""
+        with self._lock:
+            value, expires = self._data.get(key, (None, None))
+            yield None if expires is not None and time.time() > expires else value
+
+    def put(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (value, time.time() + ttl if ttl else None)
+            self._purge()
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def keys(self, prefix):
+        now = time.time()
+        with self._lock:
+            return [k for k, (_, expires) in self._data.items() if k.startswith(prefix) and (expires is None or expires >= now)]
+
+    @contextlib.contextmanager
+    def snapshot(self):
+        """Several reads that see the same state: no write lands between them."""
+        with self._lock:
+            yield
+
+    def items(self, group, after=None):
+        """Values of the keys "{group}:{id}", by id in id order, only the ids above `after` if given."""
+        now = time.time()
+        with self._lock:
+            found = {}
+            for item_id in sorted(i for i in self._groups.get(group, ()) if after is None or i > after):
+                value, expires = self._data.get(f"{group}:{item_id}", (None, None))
+                if value is not None and (expires is None or expires >= now):
+                    found[item_id] = value
+            return found
+
+    def putItems(self, group, items, ttl=None):
+        with self._lock:
+            for item_id, value in items.items():
+                self._data[f"{group}:{item_id}"] = (value, time.time() + ttl if ttl else None)
+            self._groups.setdefault(group, set()).update(items)
+            self._purge()
+
+    def deleteItems(self, group, ids=None):
+        """Deletes the listed items of the group, or all of them."""
+        with self._lock:
+            known = self._groups.get(group, set())
+            for item_id in list(known if ids is None else ids):
+                self._data.pop(f"{group}:{item_id}", None)
+                known.discard(item_id)
+            if not known:
+                self._groups.pop(group, None)
+
+    def _purge(self):
+        now = time.time()
+        if now - self._purgedAt < PURGE_INTERVAL:
+            return
+        self._purgedAt = now
+        for key in [k for k, (_, expires) in self._data.items() if expires is not None and expires < now]:
+            del self._data[key]
+        for group, ids in list(self._groups.items()):
+            ids.intersection_update([i for i in ids if f"{group}:{i}" in self._data])
+            if not ids:
+                del self._groups[group]
+
+    def lease(self, key, ttl):
+        """Takes a short exclusive lease, so only one holder refreshes a shared value."""
+        with self._lock:
+            _, expires = self._data.get(key, (None, 0))
+            if expires and time.time() < expires:
+                return False
+            self._data[key] = (True, time.time() + ttl)
+            return True
+
+
+class SqliteStore:
+    """
+    Store shared by several server processes. Values are JSON documents in a
+    WAL-mode SQLite file; transactions take the write lock (BEGIN IMMEDIATE)
+    so read-modify-write cycles from different workers never interleave.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._purgedAt = time.time()
+        # The files hold cached workspace data and the Graph token cache. The database is created
+        # private before SQLite opens it, since SQLite gives its -wal and -shm files the same mode
+        os.close(os.open(path, os.O_CREAT | os.O_RDWR, 0o600))
+        for name in (path, f"{path}-wal", f"{path}-shm"):
+            if os.path.exists(name):
+                os.chmod(name, 0o600)
+        with self._connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL)")
+
+    @contextlib.contextmanager
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        yield conn
+
+    def _read(self, conn, key):
+        row = conn.execute("SELECT value, expires FROM kv WHERE key = ?", (key,)).fetchone()
+        if row is None or (row[1] is not None and time.time() > row[1]):
+            return None
+        return json.loads(row[0])
+
+    def _write(self, conn, key, value, ttl):
+        conn.execute("INSERT OR REPLACE INTO kv (key, value, expires) VALUES (?, ?, ?)",
+                     (key, json.dumps(value), time.time() + ttl if ttl else None))
+
+    @contextlib.contextmanager
+    def transaction(self, key, default=dict, ttl=None):
+        with self._connection() as conn:
+            if conn.in_transaction:
+                # Nested in another transaction of this thread: already holds the write lock
+                value = self._read(conn, key)
+                value = default() if value is None else value
+                yield value
+                self._write(conn, key, value, ttl)
+                return
+
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                value = self._read(conn, key)
+                value = default() if value is None else value
+                yield value
+                self._write(conn, key, value, ttl)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    @contextlib.contextmanager
+    def view(self, key):
+        with self._connection() as conn:
+            yield self._read(conn, key)
+
+    def put(self, key, value, ttl=None):
+        with self._connection() as conn:
+            self._write(conn, key, value, ttl)
+            self._purge(conn)
+
+    def delete(self, key):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+
+    def keys(self, prefix):
+        with self._connection() as conn:
+            rows = conn.execute("SELECT key FROM kv WHERE key >= ? AND key < ? AND (expires IS NULL OR expires >= ?)",
+                                (prefix, prefix + "￿", time.time())).fetchall()
+            return [row[0] for row in rows]
+
+    @contextlib.contextmanager
+    def snapshot(self):
+        # A read transaction: in WAL mode its reads all see the same commit, without blocking writers
+        with self._connection() as conn:
+            if conn.in_transaction:
+                yield
+                return
+            conn.execute("BEGIN")
+            try:
+                yield
+            finally:
+                conn.execute("COMMIT")
+
+    def items(self, group, after=None):
+        prefix = f"{group}:"
+        with self._connection() as conn:
+            rows = conn.execute("SELECT key, value FROM kv WHERE key > ? AND key < ? AND (expires IS NULL OR expires >= ?) ORDER BY key",
+                                (prefix + (after or ""), prefix + "￿", time.time())).fetchall()
+        # Rows of nested groups ("{group}:{id}:...") are not items of this one
+        return {key[len(prefix):]: json.loads(value) for key, value in rows if ":" not in key[len(prefix):]}
+
+    def putItems(self, group, items, ttl=None):
+        with self._connection() as conn:
+            expires = time.time() + ttl if ttl else None
+            conn.executemany("INSERT OR REPLACE INTO kv (key, value, expires) VALUES (?, ?, ?)",
+                             [(f"{group}:{item_id}", json.dumps(value), expires) for item_id, value in items.items()])
+            self._purge(conn)
+
+    def deleteItems(self, group, ids=None):
+        prefix = f"{group}:"
+        with self._connection() as conn:
+            if ids is None:
+                conn.execute("DELETE FROM kv WHERE key >= ? AND key < ?", (prefix, prefix + "￿"))
+            else:
+                conn.executemany("DELETE FROM kv WHERE key = ?", [(prefix + item_id,) for item_id in ids])
+
+    def lease(self, key, ttl):
+        with self._connection() as conn:
+            now = time.time()
+            conn.execute("DELETE FROM kv WHERE key = ? AND expires < ?", (key, now))
+            cursor = conn.execute("INSERT OR IGNORE INTO kv (key, value, expires) VALUES (?, 'true', ?)", (key, now + ttl))
+            self._purge(conn)
+            return cursor.rowcount == 1
+
+    def _purge(self, conn):
+        # Expired rows are otherwise only skipped by reads: delete them now and then so the file stays small
+        now = time.time()
+        if now - self._purgedAt < PURGE_INTERVAL:
+            return
+        self._purgedAt = now
+        conn.execute("DELETE FROM kv WHERE expires IS NOT NULL AND expires < ?", (now,))
+
+
+def fetchOnce(name, cached, fetch, lease_ttl=30):
+    """
+    Single-flight across server workers: only the worker holding the lease on
+    `name` calls upstream, the others poll `cached` until its result shows up.
+    """
+    lease = f"lease:{name}"
+    while not store.lease(lease, lease_ttl):
+        if deadlineExpired():
+            raise DeadlineExceeded(f"Timed out waiting for another worker to fetch {name}")
+        time.sleep(0.1)
+        result = cached()
+        if result is not None:
+            return result
+    try:
+        result = cached()
+        return result if result is not None else fetch()
+    finally:
+        store.delete(lease)
+
+
+class RateLimit:
+    """
+    Token bucket kept in the store: every worker draws from the same upstream
+    request budget, so adding workers does not multiply the request rate.
+    `limit` reads "<requests>/<seconds>"; "0" turns the limit off.
+    """
+
+    def __init__(self, name, limit):
+        requests, _, seconds = limit.partition("/")
+        self.key = f"rate:{name}"
+        self.capacity = float(requests)
+        self.rate = self.capacity / float(seconds or 1)
+
+    def acquire(self):
+        if not self.capacity:
+            return
+        while True:
+            with store.transaction(self.key, lambda: {'tokens': self.capacity, 'at': time.time()}) as bucket:
+                now = time.time()
+                bucket['tokens'] = min(self.capacity, bucket['tokens'] + (now - bucket['at']) * self.rate)
+                bucket['at'] = now
+                if bucket['tokens'] >= 1:
+                    bucket['tokens'] -= 1
+                    return
+                wait = (1 - bucket['tokens']) / self.rate
+
+            remaining = remainingTime()
+            if remaining is not None and remaining < wait:
+                raise DeadlineExceeded(f"Rate limit of {self.key} leaves no room in the remaining budget")
+            time.sleep(wait)
+            checkCancelled()
+
+
+def _createStore():
+    if SHARED_STORE_PATH:
+        return SqliteStore(SHARED_STORE_PATH)
+    return MemoryStore()
+
+
+store = _createStore()
@@ -2,8 +2,35 @@
 #able to read a team and a specified thread
 
 import os
+import threading
 import requests
-from msal import ConfidentialClientApplication
+from msal import ConfidentialClientApplication, SerializableTokenCache
+from connectors.executor import checkCancelled, httpTimeout, READ_TIMEOUT
+from connectors.shared_store import store, fetchOnce, RateLimit, SHARED_STORE_PATH
+
+
+# Applications MSAL partagées entre connecteurs : le jeton en cache reste valable d'un appel à l'autre
+_apps = {}
+_appsLock = threading.Lock()
+
+# Budget de requêtes Graph partagé par tous les workers du serveur
+_rateLimit = RateLimit('graph', os.getenv("GRAPH_RATE_LIMIT", "300/10"))
+
+
+def _get_app(tenant_id, client_id, client_secret):
+    key = (tenant_id, client_id, client_secret)
+    with _appsLock:
+        app = _apps.get(key)
+        if app is None:
+            app = ConfidentialClientApplication(
+                client_id,
+                authority=f"https://login.microsoftonline.com/{tenant_id}",
+                client_credential=client_secret,
+                timeout=READ_TIMEOUT,
+                token_cache=SerializableTokenCache(),
+            )
+            _apps[key] = app
+        return app
 
 
 class TeamsConnector:
@@ -25,12 +52,8 @@ class TeamsConnector:
         if not all([self.tenant_id, self.client_id, self.client_secret]):
             raise ValueError("Configuration Azure manquante: AZURE_TENANT_ID, AZURE_CLIENT_ID, ou AZURE_CLIENT_SECRET.")
 
-        # Initialise l'application MSAL pour l'authentification
-        self.app = ConfidentialClientApplication(
-            self.client_id,
-            authority=f"https://login.microsoftonline.com/{self.tenant_id}",
-            client_credential=self.client_secret,
-        )
+        # Récupère l'application MSAL partagée pour l'authentification
+        self.app = _get_app(self.tenant_id, self.client_id, self.client_secret)
 
     def _get_token(self) -> str:
         """
@@ -38,7 +61,10 @@ class TeamsConnector:
         Tente d'abord de le récupérer depuis le cache, sinon en fait la demande.
         """
         result = self.app.acquire_token_silent(self.scope, account=None)
-        if not result:
+        if not result and SHARED_STORE_PATH:
+            # Un seul worker demande un nouveau jeton, les autres le relisent dans le magasin partagé
+            result = fetchOnce(self._token_key(), self._shared_token, self._new_token)
+        elif not result:
             result = self.app.acquire_token_for_client(scopes=self.scope)
 
         if "access_token" not in result:
@@ -46,6 +72,23 @@ class TeamsConnector:
 
         return result["access_token"]
 
+    def _token_key(self):
+        return f"teams:token:{self.tenant_id}:{self.client_id}"
+
+    def _shared_token(self):
+        """Recharge le cache MSAL depuis le magasin partagé et y cherche un jeton valide."""
+        with store.view(self._token_key()) as state:
+            if state is None:
+                return None
+            self.app.token_cache.deserialize(state)
+        return self.app.acquire_token_silent(self.scope, account=None)
+
+    def _new_token(self):
+        result = self.app.acquire_token_for_client(scopes=self.scope)
+        if "access_token" in result:
+            store.put(self._token_key(), self.app.token_cache.serialize())
+        return result
+
     def _get_auth_headers(self) -> dict:
         """
         Construit les en-têtes d'autorisation avec le jeton Bearer.
@@ -60,18 +103,43 @@ class TeamsConnector:
         """
         Effectue une requête GET vers l'API Graph.
         """
+        checkCancelled()
+        _rateLimit.acquire()
+        timeout = httpTimeout()
         headers = self._get_auth_headers()
-        response = requests.get(f"{self.base_url}{path}", headers=headers, params=params)
+        response = requests.get(f"{self.base_url}{path}", headers=headers, params=params, timeout=timeout)
         response.raise_for_status()
         return response.json() if response.content else None
 
+    def get_pages(self, path, params=None):
+        """
+        Parcourt une collection Graph page par page en suivant @odata.nextLink.
+        Accepte aussi une URL absolue (nextLink ou deltaLink déjà obtenu).
+        """
+        url = path if path.startswith("https://") else f"{self.base_url}{path}"
+        while url:
+            checkCancelled()
+            _rateLimit.acquire()
+            timeout = httpTimeout()
+            headers = self._get_auth_headers()
+            response = requests.get(url, headers=headers, params=params, timeout=timeout)
+            response.raise_for_status()
+            page = response.json() if response.content else {}
+            yield page
+            # Le nextLink contient déjà les paramètres de la requête
+            url = page.get('@odata.nextLink')
+            params = None
+
     def post(self, path, data=None):
         """
         Effectue une requête POST vers l'API Graph.
         Le corps de la requête (data) est envoyé en JSON.
         """
+        checkCancelled()
+        _rateLimit.acquire()
+        timeout = httpTimeout()
         headers = self._get_auth_headers()
-        response = requests.post(f"{self.base_url}{path}", headers=headers, json=data)
+        response = requests.post(f"{self.base_url}{path}", headers=headers, json=data, timeout=timeout)
         response.raise_for_status()
         return response.json() if response.content else None
 
@@ -79,8 +147,11 @@ class TeamsConnector:
         """
         Effectue une requête PUT vers l'API Graph.
         """
+        checkCancelled()
+        _rateLimit.acquire()
+        timeout = httpTimeout()
         headers = self._get_auth_headers()
-        response = requests.put(f"{self.base_url}{path}", headers=headers, json=data)
+        response = requests.put(f"{self.base_url}{path}", headers=headers, json=data, timeout=timeout)
         response.raise_for_status()
         return response.json() if response.content else None
 
@@ -88,7 +159,10 @@ class TeamsConnector:
         """
         Effectue une requête DELETE vers l'API Graph.
         """
+        checkCancelled()
+        _rateLimit.acquire()
+        timeout = httpTimeout()
         headers = self._get_auth_headers()
-        response = requests.delete(f"{self.base_url}{path}", headers=headers, params=params)
+        response = requests.delete(f"{self.base_url}{path}", headers=headers, params=params, timeout=timeout)
         response.raise_for_status()
         return response.json() if response.content else None
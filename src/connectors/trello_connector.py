@@ -1,6 +1,12 @@
 # Trello API Wrapper
 
+import os
 import requests
+from connectors.executor import checkCancelled, httpTimeout
+from connectors.shared_store import RateLimit
+
+# Trello allows 100 requests per 10 seconds per token; keep a margin, shared by all workers
+_rateLimit = RateLimit('trello', os.getenv("TRELLO_RATE_LIMIT", "90/10"))
 
 class TrelloConnector:
     def __init__(self, api_key, token, base_url="https://api.trello.com/1/"):
@@ -15,7 +21,9 @@ class TrelloConnector:
             'key': self.api_key,
             'token': self.token
         })
-        response = requests.get(f"{self.base_url}{path}", params=params)
+        checkCancelled()
+        _rateLimit.acquire()
+        response = requests.get(f"{self.base_url}{path}", params=params, timeout=httpTimeout())
         response.raise_for_status()
         return response.json()
 
@@ -26,7 +34,9 @@ class TrelloConnector:
             'key': self.api_key,
             'token': self.token
         })
-        response = requests.post(f"{self.base_url}{path}", data=data)
+        checkCancelled()
+        _rateLimit.acquire()
+        response = requests.post(f"{self.base_url}{path}", data=data, timeout=httpTimeout())
         response.raise_for_status()
         return response.json()
     
@@ -37,7 +47,9 @@ class TrelloConnector:
             'key': self.api_key,
             'token': self.token
         })
-        response = requests.put(f"{self.base_url}{path}", data=data)
+        checkCancelled()
+        _rateLimit.acquire()
+        response = requests.put(f"{self.base_url}{path}", data=data, timeout=httpTimeout())
         response.raise_for_status()
         return response.json()
     
@@ -48,7 +60,9 @@ class TrelloConnector:
             'key': self.api_key,
             'token': self.token
         })
-        response = requests.delete(f"{self.base_url}{path}", params=params)
+        checkCancelled()
+        _rateLimit.acquire()
+        response = requests.delete(f"{self.base_url}{path}", params=params, timeout=httpTimeout())
         response.raise_for_status()
         return response.json()
         
\ No newline at end of file
@@ -0,0 +1,245 @@
+# In-process full-text index over Trello cards/comments and Teams messages
+
+import os
+import re
+import html
+import math
+import heapq
+import threading
+import unicodedata
+from connectors.shared_store import store, SHARED_STORE_PATH
+
+STOPWORDS = set("""
+a an and are as at be by for from has have in is it its of on or that the this to was were will with
+we you your our they he she i me my not but if so do does did can
+au aux avec ce ces dans de des du elle en et eux il ils je la le les leur lui ma mais me meme mes moi
+mon ne nos notre nous on ou par pas pour qu que qui sa se ses son sur ta te tes toi ton tu un une vos
+votre vous c d j l m n s t y est sont ete etre avoir ai as avons avez ont cette cet
+""".split())
+
+# Suffixes removed by the light stemmer, longest first (French and English)
+SUFFIXES = ('issements', 'issement', 'ements', 'ement', 'ations', 'ation', 'ments', 'ment',
+            'ings', 'ing', 'euses', 'euse', 'eurs', 'eur', 'ees', 'ies', 'ee', 'es', 'ed', 'er', 's', 'x')
+
+TOKEN_RE = re.compile(r"\w+")
+TAG_RE = re.compile(r"<[^>]+>")
+
+K1 = 1.2
+B = 0.75
+SNIPPET_LENGTH = 200
+
+# Documents added, changed or removed by one server worker, replayed by the others
+CHANGES_GROUP = "search:change"
+CHANGES_SEQUENCE_KEY = "search:change-sequence"
+CHANGES_TTL = float(os.getenv("SEARCH_CHANGES_TTL_SECONDS", "3600"))
+
+
+def foldText(text):
+    """Lowercases and strips accents so 'Réunion' and 'reunion' match."""
+    folded = unicodedata.normalize('NFKD', text or "")
+    return "".join(c for c in folded if not unicodedata.combining(c)).casefold()
+
+
+def stripHtml(text):
+    """Teams message bodies are HTML: keep only the visible text."""
+    return " ".join(html.unescape(TAG_RE.sub(" ", text or "")).split())
+
+
+def _stem(token):
+    if len(token) <= 4 or token.isdigit():
+        return token
+    for suffix in SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= 3:
+            return token[:-len(suffix)]
+    return token
+
+
+def tokenize(text):
+    return [_stem(t) for t in TOKEN_RE.findall(foldText(text)) if t not in STOPWORDS and len(t) > 1]
+
+
+class SearchIndex:
+    """
+    Inverted index ranked with BM25. Documents are upserted as data is
+    fetched, so searching never calls Trello or Teams. Each server worker
+    holds its own index; fetched data and webhook changes go through
+    publish(), which logs the documents it changed so the other workers
+    replay them before searching.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._docs = {}
+        self._postings = {}
+        self._docTerms = {}
+        self._lengths = {}
+        self._totalLength = 0
+        self._cursor = None
+        # Documents changed by the publish() running on this thread
+        self._local = threading.local()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._docs)
+
+    def _changes(self):
+        return getattr(self._local, 'changes', None)
+
+    def upsert(self, doc_id, title, text, source, url=None, date=None, **extra):
+        """Indexes a document; returns False when it was already indexed as is."""
+        doc = dict(extra, id=doc_id, title=title, text=text, source=source, url=url, date=date)
+        with self._lock:
+            if self._docs.get(doc_id) == doc:
+                return False
+        terms = {}
+        for term in tokenize(title) * 2 + tokenize(text):
+            terms[term] = terms.get(term, 0) + 1
+        changes = self._changes()
+        if changes is not None:
+            changes['upserts'][doc_id] = doc
+            changes['removes'].discard(doc_id)
+        with self._lock:
+            self._removeLocked(doc_id)
+            self._docs[doc_id] = doc
+            for term, tf in terms.items():
+                self._postings.setdefault(term, {})[doc_id] = tf
+            self._docTerms[doc_id] = list(terms)
+            length = sum(terms.values())
+            self._lengths[doc_id] = length
+            self._totalLength += length
+        return True
+
+    def update(self, doc_id, **fields):
+        """Merges new field values into an indexed document, if it is known."""
+        with self._lock:
+            doc = self._docs.get(doc_id)
+            if doc is None:
+                return False
+            doc = dict(doc, **fields)
+            del doc['id']
+            self.upsert(doc_id, **doc)
+            return True
+
+    def remove(self, doc_id):
+        changes = self._changes()
+        if changes is not None:
+            # Shared even when unknown here: the worker that indexed it may be another one
+            changes['removes'].add(doc_id)
+            changes['upserts'].pop(doc_id, None)
+        with self._lock:
+            self._removeLocked(doc_id)
+
+    def _removeLocked(self, doc_id):
+        if doc_id not in self._docs:
+            return
+        del self._docs[doc_id]
+        for term in self._docTerms.pop(doc_id, ()):
+            postings = self._postings[term]
+            postings.pop(doc_id, None)
+            if not postings:
+                del self._postings[term]
+        self._totalLength -= self._lengths.pop(doc_id, 0)
+
+    def publish(self, method, *args, **kwargs):
+        """
+        Calls one of the methods below and logs the documents it added,
+        changed or removed, for the other workers. Catching up first means
+        data another worker already shared is found unchanged and not logged again.
+        """
+        if not SHARED_STORE_PATH:
+            return getattr(self, method)(*args, **kwargs)
+        self.catchUp()
+        self._local.changes = {'upserts': {}, 'removes': set()}
+        try:
+            result = getattr(self, method)(*args, **kwargs)
+            changes = self._local.changes
+        finally:
+            self._local.changes = None
+        if changes['upserts'] or changes['removes']:
+            change = {'origin': os.getpid(), 'upserts': list(changes['upserts'].values()), 'removes': sorted(changes['removes'])}
+            with store.transaction(CHANGES_SEQUENCE_KEY, lambda: {'last': 0}) as sequence:
+                sequence['last'] += 1
+                store.putItems(CHANGES_GROUP, {f"{sequence['last']:012d}": change}, CHANGES_TTL)
+        return result
+
+    def catchUp(self):
+        """Replays the documents other workers published since the last call."""
+        if not SHARED_STORE_PATH:
+            return
+        with self._lock:
+            for seq, change in store.items(CHANGES_GROUP, after=self._cursor).items():
+                self._cursor = seq
+                if change['origin'] == os.getpid():
+                    continue
+                for doc_id in change['removes']:
+                    self._removeLocked(doc_id)
+                for doc in change['upserts']:
+                    doc = dict(doc)
+                    self.upsert(doc.pop('id'), **doc)
+
+    def search(self, query, top_k=10, source=None):
+        self.catchUp()
+        terms = set(tokenize(query))
+        with self._lock:
+            count = len(self._docs)
+            if not terms or not count:
+                return []
+            avgLength = self._totalLength / count
+            scores = {}
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, tf in postings.items():
+                    norm = tf + K1 * (1 - B + B * self._lengths[doc_id] / avgLength)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (K1 + 1) / norm
+
+            if source:
+                scores = {d: s for d, s in scores.items() if self._docs[d]['source'] == source}
+            best = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+            return [self._hit(self._docs[doc_id], score) for doc_id, score in best]
+
+    def _hit(self, doc, score):
+        hit = {k: v for k, v in doc.items() if k != 'text'}
+        hit['score'] = round(score, 3)
+        hit['snippet'] = doc['text'][:SNIPPET_LENGTH]
+        return hit
+
+    # --- Feeding helpers used by the handlers ---
+
+    def setTrelloBoardCards(self, board_id, cards):
+        """Indexes a freshly fetched board and drops its cards that no longer exist."""
+        current = {f"trello:card:{card['id']}" for card in cards}
+        with self._lock:
+            stale = [d for d, doc in self._docs.items()
+                     if doc['source'] == 'trello_card' and doc.get('idBoard') == board_id and d not in current]
+            for doc_id in stale:
+                self.remove(doc_id)
+        for card in cards:
+            self.upsert(f"trello:card:{card['id']}", card['name'], card.get('desc') or "", 'trello_card',
+                        url=f"https://trello.com/c/{card['id']}", date=card.get('due'), idBoard=card.get('idBoard'))
+
+    def addTrelloComments(self, board_id, comments):
+        for comment in comments:
+            data = comment.get('data') or {}
+            card = data.get('card') or {}
+            self.upsert(f"trello:comment:{comment['id']}", card.get('name') or "", data.get('text') or "", 'trello_comment',
+                        url=f"https://trello.com/c/{card.get('id')}" if card.get('id') else None,
+                        date=comment.get('date'), idBoard=board_id, idCard=card.get('id'))
+
+    def addTeamsMessages(self, messages, context, scope):
+        """
+        `scope` is the chat or channel the messages belong to: Graph message ids
+        are only unique within it, so it is part of the document id.
+        """
+        for message in messages:
+            body = stripHtml((message.get('body') or {}).get('content'))
+            if not body:
+                continue
+            sender = ((message.get('from') or {}).get('user') or {}).get('displayName') or ""
+            self.upsert(f"teams:message:{scope}:{message['id']}", message.get('subject') or sender, body, 'teams_message',
+                        url=message.get('webUrl'), date=message.get('createdDateTime'), context=context)
+
+
+workspaceIndex = SearchIndex()
@@ -0,0 +1,188 @@
+import os
+import time
+import unicodedata
+import requests
+from connectors.shared_store import store, fetchOnce
+
+# Durée (en secondes) pendant laquelle l'annuaire est servi sans resynchronisation
+DIRECTORY_TTL = float(os.getenv("TEAMS_DIRECTORY_TTL", "300"))
+# Durée maximale pendant laquelle un worker garde la main sur le chargement d'une équipe ou d'un chat
+DIRECTORY_LEASE = float(os.getenv("TEAMS_DIRECTORY_LEASE_SECONDS", "60"))
+
+# Après un refus de Graph delta (droits absents), durée pendant laquelle on ne le retente pas
+DELTA_RETRY = float(os.getenv("TEAMS_DELTA_RETRY_SECONDS", "3600"))
+
+DELTA_UNAVAILABLE_KEY = "teams:delta-unavailable"
+USERS_KEY = "teams:users"
+NAMES_KEY = "teams:names"
+
+
+def normalizeName(name):
+    """Nom d'affichage sans accents, casse ni espaces superflus, pour les comparaisons."""
+    if not name:
+        return ""
+    folded = unicodedata.normalize('NFKD', name)
+    folded = "".join(c for c in folded if not unicodedata.combining(c))
+    return " ".join(folded.casefold().split())
+
+
+class TeamsDirectory:
+    """
+    Annuaire des membres d'équipe et des participants de chats.
+    Indexé par identifiant utilisateur et par nom d'affichage normalisé, il est
+    chargé avec pagination puis resynchronisé via Graph delta quand c'est possible.
+    Il vit dans le magasin partagé : un seul worker du serveur recharge une équipe,
+    les autres lisent le résultat.
+    """
+
+    def __init__(self, store=store):
+        self._store = store
+
+    def _rememberAll(self, users):
+        """Enregistre des (id, nom, email) en une seule transaction."""
+        with self._store.transaction(USERS_KEY) as known, self._store.transaction(NAMES_KEY) as byName:
+            for user_id, display_name, email in users:
+                if not user_id:
+                    continue
+                previous = known.get(user_id)
+                if previous and previous['displayName'] != display_name:
+                    ids = byName.get(normalizeName(previous['displayName']), [])
+                    if user_id in ids:
+                        ids.remove(user_id)
+                known[user_id] = {'id': user_id, 'displayName': display_name, 'email': email or (previous or {}).get('email')}
+                ids = byName.setdefault(normalizeName(display_name), [])
+                if user_id not in ids:
+                    ids.append(user_id)
+
+    def _remember(self, user_id, display_name, email=None):
+        self._rememberAll([(user_id, display_name, email)])
+
+    def _users(self, user_ids):
+        with self._store.view(USERS_KEY) as known:
+            known = known or {}
+            return [known[uid] for uid in user_ids if uid in known]
+
+    def get(self, user_id):
+        with self._store.view(USERS_KEY) as known:
+            return (known or {}).get(user_id)
+
+    def displayName(self, user_id):
+        user = self.get(user_id)
+        return user['displayName'] if user else None
+
+    def findByName(self, name):
+        """Utilisateurs connus dont le nom d'affichage correspond, accents et casse ignorés."""
+        with self._store.view(NAMES_KEY) as byName:
+            user_ids = list((byName or {}).get(normalizeName(name), ()))
+        return self._users(user_ids)
+
+    def _snapshot(self, key):
+        with self._store.view(key) as snapshot:
+            return snapshot
+
+    def _fresh(self, key):
+        snapshot = self._snapshot(key)
+        if snapshot is None or time.time() - snapshot['syncedAt'] > DIRECTORY_TTL:
+            return None
+        return snapshot
+
+    # --- Membres d'équipe ---
+
+    def teamMembers(self, api, team_id):
+        """Membres de l'équipe, depuis le cache s'il est frais, sinon après resynchronisation."""
+        key = f"teams:team:{team_id}"
+        team = self._snapshot(key)
+        if team is None:
+            team = fetchOnce(key, lambda: self._fresh(key), lambda: self._loadTeam(api, team_id), DIRECTORY_LEASE)
+        elif time.time() - team['syncedAt'] > DIRECTORY_TTL and self._store.lease(f"lease:{key}", DIRECTORY_LEASE):
+            # Les autres workers continuent de servir l'ancienne liste pendant la resynchronisation
+            try:
+                team = self._refreshTeam(api, team_id, team)
+            finally:
+                self._store.delete(f"lease:{key}")
+        return self._users(team['members'])
+
+    def _loadTeam(self, api, team_id):
+        member_ids, users = [], []
+        for page in api.get_pages(f"teams/{team_id}/members"):
+            for member in page.get('value', []):
+                users.append((member.get('userId'), member.get('displayName'), member.get('email')))
+                if member.get('userId'):
+                    member_ids.append(member['userId'])
+        self._rememberAll(users)
+
+        # Point de départ pour les synchronisations delta suivantes
+        delta_link = self._readDelta(api, self._deltaStart(team_id))[2] if self._deltaAvailable() else None
+        team = {'members': member_ids, 'syncedAt': time.time(), 'deltaLink': delta_link}
+        self._store.put(f"teams:team:{team_id}", team)
+        return team
+
+    def _deltaStart(self, team_id):
+        return f"groups/delta?$filter=id eq '{team_id}'&$select=members"
+
+    def _readDelta(self, api, link):
+        """Suit un lien delta jusqu'au bout, renvoie (ajoutés, retirés, nouveau deltaLink)."""
+        added, removed, delta_link = [], [], None
+        try:
+            for page in api.get_pages(link):
+                for group in page.get('value', []):
+                    for member in group.get('members@delta', []):
+                        (removed if '@removed' in member else added).append(member.get('id'))
+                delta_link = page.get('@odata.deltaLink') or delta_link
+        except Exception as e:
+            # Delta indisponible (droits Group.Read.All absents, jeton expiré...) : rechargement complet
+            print(f"Synchronisation delta Teams impossible : {e}")
+            if isinstance(e, requests.HTTPError):
+                # Refus de Graph : inutile de le redemander à chaque expiration du TTL
+                self._store.put(DELTA_UNAVAILABLE_KEY, True, DELTA_RETRY)
+            return [], [], None
+        return added, removed, delta_link
+
+    def _deltaAvailable(self):
+        with self._store.view(DELTA_UNAVAILABLE_KEY) as unavailable:
+            return not unavailable
+
+    def _refreshTeam(self, api, team_id, team):
+        if not team['deltaLink'] or not self._deltaAvailable():
+            return self._loadTeam(api, team_id)
+
+        added, removed, delta_link = self._readDelta(api, team['deltaLink'])
+        if delta_link is None:
+            return self._loadTeam(api, team_id)
+
+        unknown = [uid for uid in added if uid not in team['members'] and self.get(uid) is None]
+        for user_id in unknown:
+            user = api.get(f"users/{user_id}", params={'$select': 'id,displayName,mail'})
+            if user:
+                self._remember(user['id'], user.get('displayName'), user.get('mail'))
+
+        removed = set(removed)
+        members = [uid for uid in team['members'] if uid not in removed]
+        members += [uid for uid in added if uid not in members]
+        team = {'members': members, 'syncedAt': time.time(), 'deltaLink': delta_link}
+        self._store.put(f"teams:team:{team_id}", team)
+        return team
+
+    # --- Participants des chats ---
+
+    def chatMembers(self, api, chat_id):
+        """Participants d'un chat ; les membres de chat n'ont pas de delta Graph, on rafraîchit après TTL."""
+        key = f"teams:chat:{chat_id}"
+        chat = self._fresh(key) or fetchOnce(key, lambda: self._fresh(key), lambda: self._loadChat(api, chat_id), DIRECTORY_LEASE)
+        return self._users(chat['members'])
+
+    def _loadChat(self, api, chat_id):
+        member_ids, users = [], []
+        for page in api.get_pages(f"chats/{chat_id}/members"):
+            for member in page.get('value', []):
+                users.append((member.get('userId'), member.get('displayName'), member.get('email')))
+                if member.get('userId'):
+                    member_ids.append(member['userId'])
+        self._rememberAll(users)
+
+        chat = {'members': member_ids, 'syncedAt': time.time()}
+        self._store.put(f"teams:chat:{chat_id}", chat)
+        return chat
+
+
+teamsDirectory = TeamsDirectory()
@@ -1,7 +1,11 @@
 import os
 import json
+import requests
 from dotenv import load_dotenv
 from connectors import teams_connector
+from connectors.executor import deadlineExpired, DeadlineExceeded
+from handlers.teams_directory import teamsDirectory
+from handlers.search_index import workspaceIndex
 from datetime import datetime, timedelta, timezone
 
 
@@ -30,9 +34,14 @@ class TeamsHandler:
         if not all([self.api.tenant_id, self.api.client_id, self.api.client_secret, self.team_id, self.channel_id]):
             raise ValueError("Configuration manquante (tenant/client/secret/team/channel).")
 
-    def _format_response(self, text_content):
+    def _format_response(self, text_content, is_error=False):
         """Met en forme la réponse dans la structure attendue."""
-        return {'content': [{'type': 'text', 'text': text_content}]}
+        return {'content': [{'type': 'text', 'text': text_content}], 'isError': is_error}
+
+    def _sender_name(self, message):
+        """Nom de l'expéditeur, complété par l'annuaire quand Graph ne renvoie que l'ID."""
+        user = (message.get('from') or {}).get('user') or {}
+        return user.get('displayName') or teamsDirectory.displayName(user.get('id')) or 'Nom inconnu'
 
     def handleListTeamMembers(self):
         """
@@ -43,18 +52,16 @@ class TeamsHandler:
 
         try:
             self._check_config()
-            path = f"teams/{self.team_id}/members"
-            response_data = self.api.get(path)
+            members = teamsDirectory.teamMembers(self.api, self.team_id)
 
-            if response_data is None or 'value' not in response_data:
+            if not members:
                 return self._format_response("L'API a renvoyé une réponse vide. Aucun membre trouvé.")
 
-            members = response_data.get('value', [])
             result_parts = [f"Nombre total de membres trouvés : {len(members)}\n"]
 
             for i, member in enumerate(members, 1):
-                user_id = member.get('userId')
-                display_name = member.get('displayName', 'Nom inconnu')
+                user_id = member.get('id')
+                display_name = member.get('displayName') or 'Nom inconnu'
                 result_parts.append(f"- Membre {i}: {display_name} (ID: {user_id})")
 
             result_text = "\n".join(result_parts)
@@ -62,7 +69,7 @@ class TeamsHandler:
 
         except Exception as e:
             print(f"Erreur lors de la récupération des membres de l'équipe: {e}")
-            return self._format_response(f"Erreur de l'API Graph: {e}")
+            return self._format_response(f"Erreur de l'API Graph: {e}", is_error=True)
 
     def handleListPrivateChats(self):
         """
@@ -78,36 +85,51 @@ class TeamsHandler:
 
             # Correction de l'URL de l'API : utiliser /users/{user-id}/chats au lieu de /me/chats
             path = f"users/{self.user_id}/chats?$filter=chatType eq 'oneOnOne'"
-            response_data = self.api.get(path)
+            chats = [chat for page in self.api.get_pages(path) for chat in page.get('value', [])]
 
-            if response_data is None or 'value' not in response_data:
+            if not chats:
                 return self._format_response("L'API a renvoyé une réponse vide. Aucune discussion privée trouvée.")
 
-            chats = response_data.get('value', [])
+            self_name = os.getenv("TEAMS_USER_DISPLAY_NAME")
+            self_ids = {self.user_id}
             result_parts = ["Liste des discussions privées :\n"]
+            partial = False
 
             for chat in chats:
                 chat_id = chat.get('id')
-                members_path = f"chats/{chat_id}/members"
-                members_data = self.api.get(members_path)
-
-                if members_data and 'value' in members_data:
-                    display_names = [member.get('displayName') for member in members_data['value']]
-                    # Filtrez le nom de l'utilisateur actuel
-                    display_names = [name for name in display_names if name]
-
-                    # On affiche seulement l'autre participant
-                    partner_names = [name for name in display_names if name != os.getenv("TEAMS_USER_DISPLAY_NAME")]
-
-                    if partner_names:
-                        result_parts.append(f"- ID: {chat_id}, Participants: {', '.join(partner_names)}")
-
+                # Budget épuisé : on liste les discussions restantes sans leurs participants
+                if partial or deadlineExpired():
+                    partial = True
+                    result_parts.append(f"- ID: {chat_id}, Participants: (non récupérés)")
+                    continue
+
+                try:
+                    # Servi par l'annuaire en mémoire, sans appel API tant qu'il est frais
+                    members = teamsDirectory.chatMembers(self.api, chat_id)
+                except Exception as e:
+                    # Le budget épuisé se manifeste le plus souvent par un timeout HTTP, réduit au temps restant
+                    if not isinstance(e, (DeadlineExceeded, requests.Timeout)) and not deadlineExpired():
+                        raise
+                    partial = True
+                    result_parts.append(f"- ID: {chat_id}, Participants: (non récupérés)")
+                    continue
+
+                # On affiche seulement l'autre participant ; nos autres comptes sont retrouvés par nom dans l'annuaire
+                if self_name:
+                    self_ids.update(user['id'] for user in teamsDirectory.findByName(self_name))
+                partner_names = [m['displayName'] for m in members if m['displayName'] and m['id'] not in self_ids]
+
+                if partner_names:
+                    result_parts.append(f"- ID: {chat_id}, Participants: {', '.join(partner_names)}")
+
+            if partial:
+                result_parts.append("\n(Résultat partiel : le budget de temps a été atteint avant la fin.)")
             result_text = "\n".join(result_parts)
             return self._format_response(result_text)
 
         except Exception as e:
             print(f"Erreur lors de la liste des discussions privées : {e}")
-            return self._format_response(f"Erreur de l'API Graph : {e}")
+            return self._format_response(f"Erreur de l'API Graph : {e}", is_error=True)
 
     def handleGetPrivateMessages(self, chat_id: str):
         """
@@ -124,13 +146,11 @@ class TeamsHandler:
                 return self._format_response("L'API a renvoyé une réponse vide. Aucun message trouvé.")
 
             messages = response_data.get('value', [])
+            workspaceIndex.publish('addTeamsMessages', messages, f"chat {chat_id}", f"chat:{chat_id}")
             result_parts = [f"Messages du chat ID {chat_id}:\n"]
 
             for i, message in enumerate(messages, 1):
-                sender = message.get('from')
-                sender_name = 'Nom inconnu'
-                if sender and sender.get('user'):
-                    sender_name = sender['user'].get('displayName', 'Nom inconnu')
+                sender_name = self._sender_name(message)
                 message_body = message.get('body', {}).get('content', 'Pas de contenu')
                 created_at = message.get('createdDateTime')
 
@@ -145,7 +165,7 @@ class TeamsHandler:
 
         except Exception as e:
             print(f"Erreur lors de la récupération des messages privés : {e}")
-            return self._format_response(f"Erreur de l'API Graph : {e}")
+            return self._format_response(f"Erreur de l'API Graph : {e}", is_error=True)
 
 
     def handleGetChannelMessages(self, hours: int = 24):
@@ -165,15 +185,13 @@ class TeamsHandler:
                     "L'API a renvoyé une réponse vide. Il n'y a peut-être aucun message dans le canal.")
 
             messages = response_data.get('value', [])
+            workspaceIndex.publish('addTeamsMessages', messages, f"canal {self.channel_id}", f"channel:{self.channel_id}")
             result_parts = [f"Nombre total de messages trouvés dans le canal : {len(messages)}\n"]
 
             for i, message in enumerate(messages, 1):
                 created_at = message.get('createdDateTime')
                 message_id = message.get('id')
-                sender = message.get('from')
-                sender_name = 'Nom inconnu'
-                if sender and sender.get('user'):
-                    sender_name = sender['user'].get('displayName', 'Nom inconnu')
+                sender_name = self._sender_name(message)
                 message_body = message.get('body', {}).get('content', 'Pas de contenu')
 
                 result_parts.append("--- Message {} ---".format(i))
@@ -188,7 +206,7 @@ class TeamsHandler:
 
         except Exception as e:
             print(f"Error fetching Teams messages: {e}")
-            return self._format_response(f"Graph API error: {e}")
+            return self._format_response(f"Graph API error: {e}", is_error=True)
 
     def handleGetThreadMessages(self, parent_message_id: str):
         """
@@ -208,14 +226,12 @@ class TeamsHandler:
                     "L'API a renvoyé une réponse vide. Il n'y a peut-être aucune réponse dans ce thread.")
 
             messages = response_data.get('value', [])
+            workspaceIndex.publish('addTeamsMessages', messages, f"thread {parent_message_id}", f"channel:{self.channel_id}")
             result_parts = [f"Nombre total de réponses trouvées dans le thread : {len(messages)}\n"]
 
             for i, message in enumerate(messages, 1):
                 created_at = message.get('createdDateTime')
-                sender = message.get('from')
-                sender_name = 'Nom inconnu'
-                if sender and sender.get('user'):
-                    sender_name = sender['user'].get('displayName', 'Nom inconnu')
+                sender_name = self._sender_name(message)
                 message_body = message.get('body', {}).get('content', 'Pas de contenu')
 
                 result_parts.append("--- Réponse {} ---".format(i))
@@ -229,4 +245,4 @@ class TeamsHandler:
 
         except Exception as e:
             print(f"Error fetching Teams thread messages: {e}")
-            return self._format_response(f"Graph API error: {e}")
\ No newline at end of file
+            return self._format_response(f"Graph API error: {e}", is_error=True)
\ No newline at end of file
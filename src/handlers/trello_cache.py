@@ -0,0 +1,453 @@
+# Trello board state and comments, kept fresh by webhook events
+
+import time
+
+from connectors.executor import currentCall
+from connectors.shared_store import store
+
+BOARDS_KEY = "trello:boards"
+STATS_KEY = "trello:prefetch-stats"
+# Groups of single-key lookups: the board a card, list or commented card belongs to
+CARD_BOARDS = "trello:card-board"
+LIST_BOARDS = "trello:list-board"
+COMMENT_CARDS = "trello:comment-card"
+# Ids of the boards marked as watched, so webhook renewal can find those that lost their webhook
+WATCHED_BOARDS = "trello:watched"
+EMPTY_STATS = {'prefetched': 0, 'hits': 0, 'sameCall': 0, 'expiredUnused': 0}
+SECTIONS = ('lists', 'cards', 'members')
+BOARD_MAPS = {'cards': CARD_BOARDS, 'lists': LIST_BOARDS}
+
+# Actions that never touch the fields we keep for lists, cards or members
+IGNORED_ACTIONS = {
+    'commentCard', 'updateComment', 'deleteComment',
+    'addAttachmentToCard', 'deleteAttachmentFromCard',
+    'addChecklistToCard', 'removeChecklistFromCard', 'updateChecklist',
+    'createCheckItem', 'updateCheckItem', 'deleteCheckItem', 'updateCheckItemStateOnCard',
+    'addLabelToCard', 'removeLabelFromCard', 'createLabel', 'updateLabel', 'deleteLabel',
+    'updateBoard', 'enablePowerUp', 'disablePowerUp',
+}
+
+
+def _copyCard(card):
+    return dict(card, idMembers=list(card.get('idMembers') or []))
+
+
+class BoardCache:
+    """
+    Holds the lists, cards and members of the boards we receive webhooks for.
+    Watched boards are kept up to date by events and never expire; other
+    boards are only cached when warmed up on purpose, for a short TTL.
+    Entries live in the shared store, so every server worker sees the same
+    boards whichever of them received the webhook: a small row per board for
+    its state, and one row per list, card and member, so an event or a read
+    only rewrites what it changes.
+    """
+
+    def __init__(self, store=store):
+        self._store = store
+
+    def _key(self, board_id):
+        return f"trello:board:{board_id}"
+
+    def _group(self, board_id, section):
+        return f"trello:board:{board_id}:{section}"
+
+    def _newEntry(self):
+        return {'generation': 0, 'watched': False, 'loaded': [], 'expires': {}, 'prefetched': {}}
+
+    def _entry(self, board_id):
+        return self._store.transaction(self._key(board_id), self._newEntry)
+
+    def _count(self, stat):
+        with self._store.transaction(STATS_KEY, lambda: dict(EMPTY_STATS)) as stats:
+            stats[stat] = stats.get(stat, 0) + 1
+
+    def getBoards(self):
+        with self._store.view(BOARDS_KEY) as boards:
+            return [dict(b) for b in boards] if boards is not None else None
+
+    def setBoards(self, boards, ttl):
+        self._store.put(BOARDS_KEY, [dict(b) for b in boards], ttl)
+
+    def boardForCard(self, card_id):
+        with self._store.view(f"{CARD_BOARDS}:{card_id}") as board_id:
+            return board_id
+
+    def boardForList(self, list_id):
+        with self._store.view(f"{LIST_BOARDS}:{list_id}") as board_id:
+            return board_id
+
+    def _forget(self, group, item_id, board_id):
+        # The item left this board: drop its mapping unless another board already claimed it
+        with self._store.view(f"{group}:{item_id}") as owner:
+            if owner != board_id:
+                return
+        self._store.deleteItems(group, [item_id])
+
+    def isWarm(self, board_id, section):
+        with self._store.view(self._key(board_id)) as entry:
+            if entry is None or section not in entry['loaded']:
+                return False
+            expired = not entry['watched'] and time.time() > entry['expires'].get(section, 0)
+        if expired:
+            self._consumePrefetch(board_id, section, expired)
+        return not expired
+
+    def markPrefetchUsed(self, board_id, section):
+        """Counts a hit for a read that joined a prefetch still in flight."""
+        self._consumePrefetch(board_id, section)
+
+    def prefetchStats(self):
+        with self._store.view(STATS_KEY) as stats:
+            stats = dict(EMPTY_STATS, **(stats or {}))
+        used = stats['hits'] + stats['expiredUnused']
+        stats['hitRate'] = round(stats['hits'] / used, 2) if used else None
+        return stats
+
+    def watch(self, board_id):
+        with self._entry(board_id) as entry:
+            entry['watched'] = True
+            self._store.putItems(WATCHED_BOARDS, {board_id: True})
+
+    def unwatch(self, board_id):
+        self._store.deleteItems(WATCHED_BOARDS, [board_id])
+        self._store.delete(self._key(board_id))
+        for section in SECTIONS:
+            group = self._group(board_id, section)
+            if section in BOARD_MAPS:
+                self._store.deleteItems(BOARD_MAPS[section], list(self._store.items(group)))
+            self._store.deleteItems(group)
+
+    def watchedBoards(self):
+        return list(self._store.items(WATCHED_BOARDS))
+
+    def isWatched(self, board_id):
+        with self._store.view(self._key(board_id)) as entry:
+            return bool(entry and entry['watched'])
+
+    def generation(self, board_id):
+        """Token to pass back to a setter, so a fetch racing with an event is dropped."""
+        with self._store.view(self._key(board_id)) as entry:
+            return entry['generation'] if entry else 0
+
+    def invalidate(self, board_id, section=None):
+        with self._entry(board_id) as entry:
+            entry['generation'] += 1
+            for name in ([section] if section else SECTIONS):
+                self._drop(board_id, entry, name)
+                entry['prefetched'].pop(name, None)
+
+    def _drop(self, board_id, entry, section):
+        if section in entry['loaded']:
+            entry['loaded'].remove(section)
+            self._store.deleteItems(self._group(board_id, section))
+
+    def _get(self, board_id, section, count=True):
+        # The board row and its items are read from one snapshot, never across a concurrent _set
+        with self._store.snapshot():
+            with self._store.view(self._key(board_id)) as entry:
+                if entry is None or section not in entry['loaded']:
+                    return None
+                expired = not entry['watched'] and time.time() > entry['expires'].get(section, 0)
+                prefetched = section in entry['prefetched']
+            items = None if expired else list(self._store.items(self._group(board_id, section)).values())
+        if expired or (count and prefetched):
+            self._consumePrefetch(board_id, section, expired)
+        return items
+
+    def _consumePrefetch(self, board_id, section, expired=False):
+        with self._entry(board_id) as entry:
+            if expired and section in entry['loaded'] and time.time() > entry['expires'].get(section, 0):
+                # Warm copy expired: its rows carry the same TTL, only the board row needs updating
+                entry['loaded'].remove(section)
+            if section in entry['prefetched']:
+                origin = entry['prefetched'].pop(section)
+                if expired:
+                    self._count('expiredUnused')
+                elif origin is not None and origin == currentCall():
+                    # Read by the call whose board resolution started the prefetch: not a hit
+                    self._count('sameCall')
+                else:
+                    self._count('hits')
+
+    def _set(self, board_id, section, items, generation, ttl=None, prefetched=False):
+        with self._entry(board_id) as entry:
+            if not entry['watched'] and not ttl:
+                return False
+            if entry['generation'] != generation:
+                return False
+            # Rows of a watched board are kept current by events and never expire
+            rowTtl = None if entry['watched'] else ttl
+            group = self._group(board_id, section)
+            self._store.deleteItems(group)
+            self._store.putItems(group, {item['id']: item for item in items}, rowTtl)
+            if section in BOARD_MAPS:
+                self._store.putItems(BOARD_MAPS[section], {item['id']: board_id for item in items}, rowTtl)
+            if section not in entry['loaded']:
+                entry['loaded'].append(section)
+            entry['expires'][section] = time.time() + ttl if ttl else 0
+            if prefetched:
+                entry['prefetched'][section] = currentCall()
+                self._count('prefetched')
+            return True
+
+    def getLists(self, board_id):
+        lists = self._get(board_id, 'lists')
+        return [dict(l) for l in lists] if lists is not None else None
+
+    def setLists(self, board_id, lists, generation, ttl=None, prefetched=False):
+        return self._set(board_id, 'lists', [dict(l) for l in lists], generation, ttl, prefetched)
+
+    def getCards(self, board_id):
+        cards = self._get(board_id, 'cards')
+        return [_copyCard(c) for c in cards] if cards is not None else None
+
+    def setCards(self, board_id, cards, generation, ttl=None, prefetched=False):
+        return self._set(board_id, 'cards', [_copyCard(c) for c in cards], generation, ttl, prefetched)
+
+    def getMembers(self, board_id):
+        members = self._get(board_id, 'members')
+        return [dict(m) for m in members] if members is not None else None
+
+    def setMembers(self, board_id, members, generation, ttl=None, prefetched=False):
+        return self._set(board_id, 'members', [dict(m) for m in members], generation, ttl, prefetched)
+
+    def _item(self, board_id, section, item_id):
+        with self._store.view(f"{self._group(board_id, section)}:{item_id}") as item:
+            if item is None:
+                return None
+            return _copyCard(item) if section == 'cards' else dict(item)
+
+    def applyAction(self, action):
+        """
+        Applies a webhook action to the cached board.
+        Returns True when the cache was patched or left untouched on purpose,
+        False when the affected section had to be invalidated instead.
+        """
+        data = action.get('data', {})
+        board_id = (data.get('board') or {}).get('id')
+        if not board_id:
+            return False
+
+        action_type = action.get('type')
+        if action_type in IGNORED_ACTIONS:
+            return True
+
+        if not self.isWatched(board_id):
+            return True
+        with self._entry(board_id) as entry:
+            if not entry['watched']:
+                return True
+            entry['generation'] += 1
+
+            if action_type in ('createCard', 'updateCard', 'deleteCard', 'moveCardToBoard',
+                               'moveCardFromBoard', 'addMemberToCard', 'removeMemberFromCard',
+                               'copyCard', 'convertToCardFromCheckItem'):
+                return self._applyCardAction(board_id, entry, action_type, data)
+            if action_type in ('createList', 'updateList', 'moveListToBoard', 'moveListFromBoard'):
+                return self._applyListAction(board_id, entry, action_type, data)
+            if action_type in ('addMemberToBoard', 'removeMemberFromBoard', 'makeNormalMemberOfBoard',
+                               'makeAdminOfBoard', 'makeObserverOfBoard'):
+                return self._applyMemberAction(board_id, entry, action_type, action)
+
+            # Unknown action: drop everything rather than risk stale state
+            for name in SECTIONS:
+                self._drop(board_id, entry, name)
+            return False
+
+    def _applyCardAction(self, board_id, entry, action_type, data):
+        group = self._group(board_id, 'cards')
+        card_data = data.get('card') or {}
+        card_id = card_data.get('id')
+        if action_type in ('deleteCard', 'moveCardFromBoard') and card_id:
+            self._forget(CARD_BOARDS, card_id, board_id)
+        if 'cards' not in entry['loaded']:
+            return True
+        card = self._item(board_id, 'cards', card_id)
+
+        if action_type in ('deleteCard', 'moveCardFromBoard'):
+            if card is not None:
+                self._store.deleteItems(group, [card_id])
+            return True
+
+        if action_type == 'updateCard' and card is not None:
+            old = data.get('old') or {}
+            if old.get('closed') is False and card_data.get('closed'):
+                self._store.deleteItems(group, [card_id])
+                return True
+            for field in old:
+                if field in card and field in card_data:
+                    card[field] = card_data[field]
+            self._store.putItems(group, {card_id: card})
+            return True
+
+        if action_type in ('addMemberToCard', 'removeMemberFromCard') and card is not None:
+            member_id = data.get('idMember') or (data.get('member') or {}).get('id')
+            if member_id:
+                if action_type == 'addMemberToCard' and member_id not in card['idMembers']:
+                    card['idMembers'].append(member_id)
+                elif action_type == 'removeMemberFromCard' and member_id in card['idMembers']:
+                    card['idMembers'].remove(member_id)
+                self._store.putItems(group, {card_id: card})
+                return True
+
+        # New or unknown card: the payload lacks desc/due/members, refetch on next read
+        self._drop(board_id, entry, 'cards')
+        return False
+
+    def _applyListAction(self, board_id, entry, action_type, data):
+        group = self._group(board_id, 'lists')
+        list_data = data.get('list') or {}
+        list_id = list_data.get('id')
+        if action_type == 'moveListFromBoard' and list_id:
+            self._forget(LIST_BOARDS, list_id, board_id)
+        if 'lists' not in entry['loaded']:
+            return True
+        lst = self._item(board_id, 'lists', list_id)
+
+        if action_type == 'moveListFromBoard':
+            if lst is not None:
+                self._store.deleteItems(group, [list_id])
+            return True
+        if action_type == 'createList' and list_id:
+            self._store.putItems(group, {list_id: {'id': list_id, 'name': list_data.get('name'), 'idBoard': board_id}})
+            self._store.putItems(LIST_BOARDS, {list_id: board_id})
+            return True
+        if action_type == 'updateList' and lst is not None:
+            old = data.get('old') or {}
+            if list_data.get('closed'):
+                self._store.deleteItems(group, [list_id])
+                return True
+            if 'name' in old:
+                lst['name'] = list_data.get('name', lst['name'])
+                self._store.putItems(group, {list_id: lst})
+            if 'closed' not in old:
+                return True
+
+        self._drop(board_id, entry, 'lists')
+        return False
+
+    def _applyMemberAction(self, board_id, entry, action_type, action):
+        if 'members' not in entry['loaded']:
+            return True
+        group = self._group(board_id, 'members')
+        member = action.get('member') or {}
+        member_id = member.get('id') or (action.get('data') or {}).get('idMember')
+
+        if action_type == 'removeMemberFromBoard':
+            if member_id:
+                self._store.deleteItems(group, [member_id])
+            return True
+        if self._item(board_id, 'members', member_id) is not None:
+            return True
+        if member_id and 'fullName' in member and 'username' in member:
+            self._store.putItems(group, {member_id: {'id': member_id, 'fullName': member['fullName'], 'username': member['username']}})
+            return True
+
+        self._drop(board_id, entry, 'members')
+        return False
+
+
+
+class CommentIndex:
+    """
+    Board comments, one store row each, with a card -> board map for card
+    lookups. Filled page by page from the board action feed; `newest`/`oldest`
+    record how far the feed has been read in each direction so later loads
+    only fetch what is missing.
+    """
+
+    def __init__(self, store=store):
+        self._store = store
+
+    def _key(self, board_id):
+        return f"trello:comments:{board_id}"
+
+    def _entry(self, board_id):
+        return self._store.transaction(self._key(board_id), lambda: {
+            'newest': None, 'oldest': None, 'complete': False, 'pull': False})
+
+    def state(self, board_id):
+        with self._store.view(self._key(board_id)) as entry:
+            if entry is None:
+                return None
+            return {'newest': entry['newest'], 'oldest': entry['oldest'], 'complete': entry['complete'],
+                    'pull': entry.get('pull', False)}
+
+    def requestPull(self, board_id):
+        """
+        Marks the feed as holding comments no webhook delivered: those posted
+        before the board's webhook existed or was reactivated, or while the
+        server was down. The next load pulls them once.
+        """
+        if self.state(board_id) is None:
+            return
+        with self._entry(board_id) as entry:
+            entry['pull'] = True
+
+    def markPulled(self, board_id):
+        with self._entry(board_id) as entry:
+            entry['pull'] = False
+
+    def boardForCard(self, card_id):
+        with self._store.view(f"{COMMENT_CARDS}:{card_id}") as board_id:
+            return board_id
+
+    def addComments(self, board_id, comments, fromFeed=True):
+        """
+        Indexes comments. Only pages read from the board feed move the
+        newest/oldest cursors: a comment we posted ourselves, or one pushed by
+        a webhook, says nothing about what else the feed holds around it.
+        """
+        with self._entry(board_id) as entry:
+            self._addComments(entry, board_id, comments, fromFeed)
+
+    def _addComments(self, entry, board_id, comments, fromFeed=True):
+        self._store.putItems(self._key(board_id), {comment['id']: comment for comment in comments})
+        cards = {((c.get('data') or {}).get('card') or {}).get('id') for c in comments}
+        self._store.putItems(COMMENT_CARDS, {card_id: board_id for card_id in cards if card_id})
+        if not fromFeed:
+            return
+        for comment in comments:
+            if entry['newest'] is None or comment['date'] > entry['newest']:
+                entry['newest'] = comment['date']
+            if entry['oldest'] is None or comment['date'] < entry['oldest']:
+                entry['oldest'] = comment['date']
+
+    def markComplete(self, board_id):
+        with self._entry(board_id) as entry:
+            entry['complete'] = True
+
+    def lookup(self, board_id, card_id=None, since=None, before=None):
+        """Comments of the board (or of one card), newest first, with optional date bounds."""
+        with self._store.snapshot():
+            if self.state(board_id) is None:
+                return []
+            comments = list(self._store.items(self._key(board_id)).values())
+        if card_id is not None:
+            comments = [c for c in comments if ((c.get('data') or {}).get('card') or {}).get('id') == card_id]
+        comments = [c for c in comments if (since is None or c['date'] > since) and (before is None or c['date'] < before)]
+        return sorted(comments, key=lambda c: c['date'], reverse=True)
+
+    def applyAction(self, action):
+        data = action.get('data') or {}
+        board_id = (data.get('board') or {}).get('id')
+        action_type = action.get('type')
+        if self.state(board_id) is None:
+            return
+        with self._entry(board_id) as entry:
+            comment_id = (data.get('action') or {}).get('id')
+            if action_type == 'commentCard':
+                self._addComments(entry, board_id, [{'id': action['id'], 'data': data, 'memberCreator': action.get('memberCreator'), 'date': action['date']}], fromFeed=False)
+            elif action_type == 'updateComment' and comment_id:
+                with self._store.view(f"{self._key(board_id)}:{comment_id}") as comment:
+                    comment = dict(comment) if comment is not None else None
+                if comment is not None:
+                    comment['data'] = dict(comment['data'], text=data['action'].get('text'))
+                    self._store.putItems(self._key(board_id), {comment_id: comment})
+            elif action_type == 'deleteComment' and comment_id:
+                self._store.deleteItems(self._key(board_id), [comment_id])
+
+
+boardCache = BoardCache()
+commentIndex = CommentIndex()
@@ -1,8 +1,81 @@
 
 import os
+import copy
 import json
+import threading
+from concurrent.futures import Future
 from dotenv import load_dotenv
 from connectors import trello_connector 
+from connectors.executor import remainingTime, deadlineExpired, DeadlineExceeded, WorkCancelled, checkCancelled, currentCall
+from connectors.shared_store import fetchOnce, SHARED_STORE_PATH
+from handlers.trello_cache import boardCache, commentIndex
+from handlers.trello_webhook_handler import TrelloWebhookHandler
+from handlers.search_index import workspaceIndex
+
+# How long (seconds) prefetched data of an unwatched board stays usable
+WARM_TTL = float(os.getenv("TRELLO_WARM_TTL", "120"))
+# How long the list of boards used for project name resolution is reused
+BOARDS_TTL = float(os.getenv("TRELLO_BOARDS_TTL", "300"))
+# Cards requested per page when streaming a board, and the card fields we keep
+CARDS_PAGE_SIZE = int(os.getenv("TRELLO_CARDS_PAGE_SIZE", "500"))
+CARD_FIELDS = "name,due,idList,idBoard,dueComplete,desc,idMembers"
+# With several server workers, how long a board fetched by one worker is reused by the others
+SHARED_TTL = float(os.getenv("TRELLO_SHARED_TTL", "10")) if SHARED_STORE_PATH else None
+# How long a worker may hold the right to fetch a board section before others take over
+FETCH_LEASE = float(os.getenv("TRELLO_FETCH_LEASE_SECONDS", "30"))
+
+# Upstream reads in progress, so a tool read joins a prefetch of the same data instead of repeating it
+_inflight = {}
+_inflightLock = threading.Lock()
+
+
+def _singleFlight(key, fetch, warm=False, cached=None):
+    with _inflightLock:
+        future = _inflight.get(key)
+        leader = future is None
+        if leader:
+            future = Future()
+            future.warm = warm
+            future.call = currentCall()
+            future.callerFailure = False
+            _inflight[key] = future
+
+    if not leader:
+        try:
+            result = future.result(timeout=remainingTime())
+        except BaseException:
+            # Only our own cancellation stops us; the leader's belongs to its caller
+            checkCancelled()
+            # A prefetch runs under its own, shorter budget, and a leader from another call may have
+            # been cancelled or run out of its budget: in those cases fetch again under ours
+            retry = (future.warm and not warm) or (future.callerFailure and future.call != currentCall())
+            if not retry or deadlineExpired():
+                raise
+            return _singleFlight(key, fetch, warm, cached)
+        if future.warm and not warm:
+            boardCache.markPrefetchUsed(key[1], key[0])
+        return copy.deepcopy(result)
+
+    try:
+        result = _fetchOnce(key, fetch, cached)
+    except BaseException as e:
+        # Unregistered first, so a follower retrying after this failure starts a new fetch
+        with _inflightLock:
+            _inflight.pop(key, None)
+        future.callerFailure = isinstance(e, WorkCancelled) or deadlineExpired()
+        future.set_exception(e)
+        raise
+    with _inflightLock:
+        _inflight.pop(key, None)
+    future.set_result(result)
+    return result
+
+
+def _fetchOnce(key, fetch, cached):
+    # With several server workers, one of them fetches and the others read its result from the store
+    if not SHARED_STORE_PATH or cached is None:
+        return fetch()
+    return fetchOnce(f"trello:{key[0]}:{key[1]}", cached, fetch, FETCH_LEASE)
 
 class TrelloHandler:
 
@@ -14,12 +87,24 @@ class TrelloHandler:
 
         )
 
+    def _watchBoard(self, board_id, warm=False):
+        # Boards with an active webhook are served from the cache, others are fetched every time.
+        # Warm-up and prefetch reads never register one: a board gets its webhook when a tool reads it.
+        if not warm and not boardCache.isWatched(board_id):
+            TrelloWebhookHandler().handleEnsureWebhook(board_id)
+        return boardCache.generation(board_id)
+
     def handleGetBoards(self):
         try:
+            cached = boardCache.getBoards()
+            if cached is not None:
+                return cached
             boards = self.api.get("members/me/boards")
             openBoards = [board for board in boards if not board.get('closed', False)]
             
-            return [{'id': b['id'], 'name': b['name'], 'url': b['url'], 'desc': b['desc'], 'memberships': b['memberships']} for b in openBoards]
+            result = [{'id': b['id'], 'name': b['name'], 'url': b['url'], 'desc': b['desc'], 'memberships': b['memberships']} for b in openBoards]
+            boardCache.setBoards(result, BOARDS_TTL)
+            return result
 
         except Exception as e:
             print(f"Error fetching boards: {e}")
@@ -34,27 +119,68 @@ class TrelloHandler:
             print(f"Error fetching board details: {e}")
             return None
     
-    def handleGetListForBoard(self, board_id):
+    def handleGetListForBoard(self, board_id, warm=False):
         try:
-            lists = self.api.get(f"boards/{board_id}/lists")
-            openLists = [lst for lst in lists if not lst.get('closed', False)]
-            
-            return [{'id': l['id'], 'name': l['name'], 'idBoard': l['idBoard']} for l in openLists]
+            cached = boardCache.getLists(board_id)
+            if cached is not None:
+                return cached
+            return _singleFlight(('lists', board_id), lambda: self._fetchLists(board_id, warm), warm,
+                                 lambda: boardCache.getLists(board_id))
                     
         except Exception as e:
             print(f"Error fetching lists: {e}")
             return None
+
+    def _fetchLists(self, board_id, warm):
+        generation = self._watchBoard(board_id, warm)
+        lists = self.api.get(f"boards/{board_id}/lists")
+        openLists = [lst for lst in lists if not lst.get('closed', False)]
+        
+        result = [{'id': l['id'], 'name': l['name'], 'idBoard': l['idBoard']} for l in openLists]
+        boardCache.setLists(board_id, result, generation, ttl=WARM_TTL if warm else SHARED_TTL, prefetched=warm)
+        return result
         
-    def handleGetCardsForBoard(self, board_id):
+    def handleGetCardsForBoard(self, board_id, warm=False):
         try:
-            cards = self.api.get(f"boards/{board_id}/cards")
-            
-            return [{'id': c['id'], 'name': c['name'], 'due': c['due'], 'idList': c['idList'], 'idBoard': c['idBoard'], 'dueComplete': c['dueComplete'], 'desc': c['desc'], 'idMembers': c['idMembers']} for c in cards]
+            cached = boardCache.getCards(board_id)
+            if cached is not None:
+                return cached
+            return _singleFlight(('cards', board_id), lambda: self._fetchCards(board_id, warm), warm,
+                                 lambda: boardCache.getCards(board_id))
                     
         except Exception as e:
             print(f"Error fetching cards: {e}")
             return None
 
+    def handleIterCards(self, board_id, fields=CARD_FIELDS):
+        """
+        Streams the open cards of a board, one page at a time, using Trello's
+        limit/before cursor. The stream holds one page; _fetchCards still keeps
+        every projected card, since the cache and the index need the full board.
+        """
+        cursor = None
+        while True:
+            params = {'filter': 'open', 'fields': fields, 'limit': CARDS_PAGE_SIZE}
+            if cursor:
+                params['before'] = cursor
+            page = self.api.get(f"boards/{board_id}/cards", params=params)
+            yield from page
+            if len(page) < CARDS_PAGE_SIZE:
+                return
+            # Card ids grow with creation time: continue below the oldest card of this page
+            cursor = min(c['id'] for c in page)
+
+    def _projectCards(self, cards):
+        for c in cards:
+            yield {'id': c['id'], 'name': c['name'], 'due': c['due'], 'idList': c['idList'], 'idBoard': c['idBoard'], 'dueComplete': c['dueComplete'], 'desc': c['desc'], 'idMembers': c['idMembers']}
+
+    def _fetchCards(self, board_id, warm):
+        generation = self._watchBoard(board_id, warm)
+        result = list(self._projectCards(self.handleIterCards(board_id)))
+        boardCache.setCards(board_id, result, generation, ttl=WARM_TTL if warm else SHARED_TTL, prefetched=warm)
+        workspaceIndex.publish('setTrelloBoardCards', board_id, result)
+        return result
+
     def handleGetMemberDetails(self, member_id):
         try:
             member = self.api.get(f"members/{member_id}")
@@ -64,34 +190,55 @@ class TrelloHandler:
             print(f"Error fetching member details: {e}")
             return None
         
-    def handleGetTaskOverdue(self, board_id, dateLimit = None):
-        try:
-            cards = self.api.get(f"boards/{board_id}/cards")
-            from datetime import datetime, timezone
-            if(dateLimit is not None):
-                dateLimit = datetime.fromisoformat(dateLimit)
-            else:
-                dateLimit = datetime.now(timezone.utc)
-            overdue_cards = [c for c in cards if c['due'] and not c['dueComplete'] and datetime.fromisoformat(c['due'][:-1] + '+00:00') < dateLimit]
+    def handleIterTaskOverdue(self, board_id, dateLimit = None):
+        """
+        Yields the overdue cards of the board. The cards come from
+        handleGetCardsForBoard, so a miss joins a prefetch of the same board and
+        fills the cache and search index. The whole board is read, and held,
+        before the first card is yielded; the generator only keeps the caller's
+        per-card member lookups lazy.
+        """
+        from datetime import datetime, timezone
+        if(dateLimit is not None):
+            dateLimit = datetime.fromisoformat(str(dateLimit))
+        else:
+            dateLimit = datetime.now(timezone.utc)
 
-            return [{'id': c['id'], 'name': c['name'], 'due': c['due'], 'idList': c['idList'], 'idBoard': c['idBoard'], 'dueComplete': c['dueComplete'], 'desc': c['desc'], 'idMembers': c['idMembers']} for c in overdue_cards]
-                    
-        except Exception as e:
-            print(f"Error fetching overdue tasks: {e}")
-            return None
+        cards = self.handleGetCardsForBoard(board_id)
+        if cards is None:
+            if deadlineExpired():
+                raise DeadlineExceeded(f"Latency budget exhausted before the cards of board {board_id} were read.")
+            raise RuntimeError(f"Could not fetch the cards of board {board_id}.")
+        for c in cards:
+            if c['due'] and not c['dueComplete'] and datetime.fromisoformat(c['due'][:-1] + '+00:00') < dateLimit:
+                yield c
         
-    def handleGetBoardMembers(self, board_id):
+    def handleGetBoardMembers(self, board_id, warm=False):
         try:
-            members = self.api.get(f"boards/{board_id}/members")
-            return [{'id': m['id'], 'fullName': m['fullName'], 'username': m['username']} for m in members]
+            cached = boardCache.getMembers(board_id)
+            if cached is not None:
+                return cached
+            return _singleFlight(('members', board_id), lambda: self._fetchMembers(board_id, warm), warm,
+                                 lambda: boardCache.getMembers(board_id))
                     
         except Exception as e:
             print(f"Error fetching board members: {e}")
             return None
+
+    def _fetchMembers(self, board_id, warm):
+        generation = self._watchBoard(board_id, warm)
+        members = self.api.get(f"boards/{board_id}/members")
+        result = [{'id': m['id'], 'fullName': m['fullName'], 'username': m['username']} for m in members]
+        boardCache.setMembers(board_id, result, generation, ttl=WARM_TTL if warm else SHARED_TTL, prefetched=warm)
+        return result
         
     # Comments on cards
     def handleGetCommentsForCard(self, card_id):
         try:
+            # Cards of a board whose comment feed is loaded are answered locally
+            board_id = commentIndex.boardForCard(card_id)
+            if board_id is not None:
+                return self.handleGetBoardComments(board_id, card_id=card_id)
             actions = self.api.get(f"cards/{card_id}/actions", params={'filter': 'commentCard'})
             comments = [a for a in actions if a['type'] == 'commentCard']
             return [{'id': c['id'], 'data': c['data'], 'memberCreator': c['memberCreator'], 'date': c['date']} for c in comments]
@@ -100,11 +247,62 @@ class TrelloHandler:
             print(f"Error fetching comments: {e}")
             return None
     
+    def handleStreamBoardComments(self, board_id, since=None, before=None, page_size=1000):
+        """Yields the board's comments page by page, newest first, following Trello's `before` cursor."""
+        cursor = before
+        while True:
+            params = {'filter': 'commentCard', 'limit': page_size}
+            if since:
+                params['since'] = since
+            if cursor:
+                params['before'] = cursor
+            actions = self.api.get(f"boards/{board_id}/actions", params=params)
+            page = [{'id': a['id'], 'data': a['data'], 'memberCreator': a['memberCreator'], 'date': a['date']} for a in actions if a['type'] == 'commentCard']
+            if page:
+                yield page
+            if len(actions) < page_size:
+                return
+            cursor = actions[-1]['id']
+
+    def _loadBoardComments(self, board_id):
+        state = commentIndex.state(board_id)
+        if state is None or not state['complete']:
+            # First load, or resume an interrupted one from the oldest page read so far
+            before = state['oldest'] if state else None
+            for page in self.handleStreamBoardComments(board_id, before=before):
+                commentIndex.addComments(board_id, page)
+                workspaceIndex.publish('addTrelloComments', board_id, page)
+            commentIndex.markComplete(board_id)
+            return
+        if state['pull'] or not boardCache.isWatched(board_id):
+            # No webhook pushes new comments for this board, or its webhook missed some: pull only what
+            # came after the last one read from the feed (everything, if the board had no comment yet)
+            for page in self.handleStreamBoardComments(board_id, since=state['newest']):
+                commentIndex.addComments(board_id, page)
+                workspaceIndex.publish('addTrelloComments', board_id, page)
+            if state['pull']:
+                commentIndex.markPulled(board_id)
+
+    def handleGetBoardComments(self, board_id, card_id=None, since=None, before=None):
+        try:
+            self._watchBoard(board_id)
+            self._loadBoardComments(board_id)
+            return commentIndex.lookup(board_id, card_id=card_id, since=since, before=before)
+
+        except Exception as e:
+            print(f"Error fetching board comments: {e}")
+            return None
+
     def handleAddCommentToCard(self, card_id, comment_text):
         try:
             payload = {'text': comment_text}
             comment = self.api.post(f"cards/{card_id}/actions/comments", data=payload)
-            return {'id': comment['id'], 'data': comment['data'], 'memberCreator': comment['memberCreator'], 'date': comment['date']}
+            result = {'id': comment['id'], 'data': comment['data'], 'memberCreator': comment['memberCreator'], 'date': comment['date']}
+            board_id = (comment['data'].get('board') or {}).get('id')
+            if board_id and commentIndex.state(board_id) is not None:
+                commentIndex.addComments(board_id, [result], fromFeed=False)
+            workspaceIndex.publish('addTrelloComments', board_id, [result])
+            return result
                     
         except Exception as e:
             print(f"Error adding comment: {e}")
@@ -112,11 +310,13 @@ class TrelloHandler:
 
     def handleboardGetdate(self, board_id):
         try:
-            cards = self.api.get(f"boards/{board_id}/cards", params={"fields": "name,due,closed,dueComplete"})
-            opencard = [c for c in cards if not c.get('closed', False)]
+            cards = boardCache.getCards(board_id)
+            if cards is None:
+                # Archived cards are filtered by Trello (filter=open), only four fields are transferred
+                cards = self.handleIterCards(board_id, fields="name,due,dueComplete")
 
             return [{"id": c["id"], "name": c["name"], "due": c.get("due"), "dueComplete": c.get("dueComplete")} for c
-                    in opencard]
+                    in cards]
         except Exception as e:
             print(f"Error fetching lists: {e}")
             return None
@@ -131,10 +331,36 @@ class TrelloHandler:
             print(f"Error fetching card members: {e}")
             return None
         
+    def handleGetCardBoard(self, card_id):
+        try:
+            board_id = boardCache.boardForCard(card_id) or commentIndex.boardForCard(card_id)
+            if board_id is None:
+                board_id = self.api.get(f"cards/{card_id}", params={'fields': 'idBoard'})['idBoard']
+            return board_id
+        except Exception as e:
+            print(f"Error fetching card board: {e}")
+            return None
+
+    def handleGetListBoard(self, list_id):
+        try:
+            board_id = boardCache.boardForList(list_id)
+            if board_id is None:
+                board_id = self.api.get(f"lists/{list_id}", params={'fields': 'idBoard'})['idBoard']
+            return board_id
+        except Exception as e:
+            print(f"Error fetching list board: {e}")
+            return None
+
+    def _cardsChanged(self, board_id):
+        # Our own write: drop the cached cards now rather than wait for the webhook
+        if board_id:
+            boardCache.invalidate(board_id, 'cards')
+
     # Assign member to card
     def handleAssignMemberToCard(self, card_id, member_id):
         try:
             self.api.post(f"cards/{card_id}/idMembers", data={'value': member_id})
+            self._cardsChanged(boardCache.boardForCard(card_id))
             return {'status': 'success', 'message': f'Member {member_id} assigned to card {card_id}'}
         except Exception as e:
             print(f"Error assigning member to card: {e}")
@@ -144,6 +370,7 @@ class TrelloHandler:
     def handleRemoveMemberFromCard(self, card_id, member_id):
         try:
             self.api.delete(f"cards/{card_id}/idMembers/{member_id}")
+            self._cardsChanged(boardCache.boardForCard(card_id))
             return {'status': 'success', 'message': f'Member {member_id} removed from card {card_id}'}
         except Exception as e:
             print(f"Error removing member from card: {e}")
@@ -159,6 +386,7 @@ class TrelloHandler:
                 payload['due'] = due_date
             payload['idList'] = list_id
             card = self.api.post(f"cards", data=payload)
+            self._cardsChanged(card['idBoard'])
             return {'id': card['id'], 'name': card['name'], 'desc': card.get('desc'), 'due': card.get('due'), 'idList': card['idList'], 'idBoard': card['idBoard']}
         except Exception as e:
             print(f"Error adding card to list: {e}")
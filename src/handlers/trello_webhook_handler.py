@@ -0,0 +1,181 @@
+import os
+import time
+import hmac
+import base64
+import hashlib
+from dotenv import load_dotenv
+from connectors import trello_connector
+from handlers.trello_cache import boardCache, commentIndex
+from handlers.search_index import workspaceIndex
+
+# Seconds to wait before retrying a board whose webhook could not be set up
+RETRY_DELAY = 300
+# Seconds between two checks for webhooks Trello disabled after failed deliveries
+RENEW_INTERVAL = float(os.getenv("TRELLO_WEBHOOK_RENEW_SECONDS", str(RETRY_DELAY)))
+_failedAt = {}
+
+class TrelloWebhookHandler:
+    """
+    Registers Trello webhooks on the boards we read and applies the events
+    Trello pushes back to the shared board cache.
+    """
+
+    def __init__(self):
+        load_dotenv()
+        self.api = trello_connector.TrelloConnector(
+            api_key=os.getenv("TRELLO_API_KEY"),
+            token=os.getenv("TRELLO_TOKEN")
+        )
+        self.secret = os.getenv("TRELLO_API_SECRET")
+        self.callback_url = os.getenv("TRELLO_WEBHOOK_CALLBACK_URL")
+
+    def isConfigured(self):
+        return bool(self.secret and self.callback_url and self.api.api_key and self.api.token)
+
+    def verifySignature(self, body: bytes, signature: str) -> bool:
+        # Trello signs base64(HMAC-SHA1(app secret, raw body + callback URL))
+        if not self.isConfigured() or not signature:
+            return False
+        content = body + self.callback_url.encode('utf-8')
+        digest = hmac.new(self.secret.encode('utf-8'), content, hashlib.sha1).digest()
+        expected = base64.b64encode(digest).decode('ascii')
+        return hmac.compare_digest(expected, signature)
+
+    def handleListWebhooks(self):
+        try:
+            webhooks = self.api.get(f"tokens/{self.api.token}/webhooks")
+            return [w for w in webhooks if w.get('callbackURL') == self.callback_url]
+        except Exception as e:
+            print(f"Error fetching webhooks: {e}")
+            return None
+
+    def handleRegisterWebhook(self, board_id):
+        try:
+            webhook = self.api.post("webhooks", data={
+                'callbackURL': self.callback_url,
+                'idModel': board_id,
+                'description': f"EPISEN AI team support - board {board_id}"
+            })
+            return {'id': webhook['id'], 'idModel': webhook['idModel'], 'active': webhook.get('active', True)}
+        except Exception as e:
+            print(f"Error registering webhook: {e}")
+            return None
+
+    def handleEnsureWebhook(self, board_id):
+        """Makes sure an active webhook exists for the board, then marks it as watched."""
+        if not self.isConfigured():
+            return False
+        if boardCache.isWatched(board_id):
+            return True
+        if time.monotonic() - _failedAt.get(board_id, float('-inf')) < RETRY_DELAY:
+            return False
+
+        webhooks = self.handleListWebhooks()
+        if webhooks is None:
+            _failedAt[board_id] = time.monotonic()
+            return False
+
+        existing = next((w for w in webhooks if w.get('idModel') == board_id), None)
+        if existing is None:
+            existing = self.handleRegisterWebhook(board_id)
+        elif not existing.get('active', True):
+            existing = self._reactivate(existing)
+
+        if existing is None:
+            _failedAt[board_id] = time.monotonic()
+            return False
+        _failedAt.pop(board_id, None)
+        boardCache.invalidate(board_id)
+        boardCache.watch(board_id)
+        commentIndex.requestPull(board_id)
+        return True
+
+    def handleRenewWebhooks(self, resync=True):
+        """
+        Reactivates webhooks Trello disabled after failed deliveries. Boards
+        whose events may have been missed are re-read: all of them on a resync
+        (at startup), otherwise those whose webhook was disabled or not yet
+        watched. Watched boards left without an active webhook are dropped
+        from the cache rather than served stale.
+        Returns the boards re-read, or None when the webhooks could not be listed.
+        """
+        if not self.isConfigured():
+            return []
+        webhooks = self.handleListWebhooks()
+        if webhooks is None:
+            return None
+        renewed = []
+        active = set()
+        for webhook in webhooks:
+            missed = resync or not webhook.get('active', True) or not boardCache.isWatched(webhook['idModel'])
+            if not webhook.get('active', True):
+                webhook = self._reactivate(webhook)
+            if not webhook:
+                continue
+            active.add(webhook['idModel'])
+            if missed:
+                boardCache.invalidate(webhook['idModel'])
+                boardCache.watch(webhook['idModel'])
+                commentIndex.requestPull(webhook['idModel'])
+                renewed.append(webhook['idModel'])
+        for board_id in boardCache.watchedBoards():
+            if board_id not in active:
+                boardCache.unwatch(board_id)
+        return renewed
+
+    def _reactivate(self, webhook):
+        try:
+            updated = self.api.put(f"webhooks/{webhook['id']}", data={'active': 'true'})
+            return {'id': updated['id'], 'idModel': updated['idModel'], 'active': updated.get('active', True)}
+        except Exception as e:
+            print(f"Error reactivating webhook {webhook.get('id')}: {e}")
+            return None
+
+    def handleEvent(self, payload):
+        action = (payload or {}).get('action')
+        if not action:
+            return False
+        try:
+            commentIndex.applyAction(action)
+            self._indexAction(action)
+            return boardCache.applyAction(action)
+        except Exception as e:
+            print(f"Error applying webhook event: {e}")
+            board_id = ((action.get('data') or {}).get('board') or {}).get('id')
+            if board_id:
+                boardCache.invalidate(board_id)
+            return False
+
+    def _indexAction(self, action):
+        """Keeps the search index of every worker in line with card and comment events."""
+        data = action.get('data') or {}
+        card = data.get('card') or {}
+        action_type = action.get('type')
+
+        if action_type == 'deleteCard' or (action_type == 'updateCard' and card.get('closed')):
+            workspaceIndex.publish('remove', f"trello:card:{card.get('id')}")
+        elif action_type == 'updateCard':
+            old = data.get('old') or {}
+            fields = {}
+            if 'name' in old:
+                fields['title'] = card.get('name')
+            if 'desc' in old:
+                fields['text'] = card.get('desc') or ""
+            if fields:
+                workspaceIndex.publish('update', f"trello:card:{card.get('id')}", **fields)
+        elif action_type == 'commentCard':
+            comment = {'id': action['id'], 'data': data, 'date': action.get('date')}
+            workspaceIndex.publish('addTrelloComments', (data.get('board') or {}).get('id'), [comment])
+        elif action_type == 'updateComment':
+            comment_id = (data.get('action') or {}).get('id')
+            workspaceIndex.publish('update', f"trello:comment:{comment_id}", text=(data.get('action') or {}).get('text') or "")
+        elif action_type == 'deleteComment':
+            workspaceIndex.publish('remove', f"trello:comment:{(data.get('action') or {}).get('id')}")
+
+
+def renewWebhooks(resync=False):
+    try:
+        return TrelloWebhookHandler().handleRenewWebhooks(resync)
+    except Exception as e:
+        print(f"Error renewing webhooks: {e}")
+        return None
@@ -0,0 +1,99 @@
+from datetime import datetime, timezone
+
+# Lists whose cards count as completed even when the due date is not ticked
+DONE_LIST_NAMES = {'done', 'terminé', 'termine', 'fait', 'finished', 'complete', 'completed'}
+
+# Upper bound on the cards listed by name in each digest section
+MAX_LISTED_CARDS = 25
+
+AGING_BUCKETS = ('0-1d', '1-7d', '>7d')
+
+
+def _ratio(done, total):
+    return round(done / total, 2) if total else None
+
+
+class BoardAnalytics:
+    """
+    Aggregates a board's cards in a single pass into a compact digest:
+    counts per list and member, overdue aging, completion ratios and the
+    cards missing an assignee or a due date.
+    """
+
+    def __init__(self, now=None):
+        self.now = now or datetime.now(timezone.utc)
+
+    def _agingBucket(self, due):
+        days = (self.now - due).total_seconds() / 86400
+        if days <= 1:
+            return '0-1d'
+        if days <= 7:
+            return '1-7d'
+        return '>7d'
+
+    def buildDigest(self, board, lists, cards, members=None):
+        listNames = {l['id']: l['name'] for l in lists or []}
+        memberNames = {m['id']: m['fullName'] for m in members or []}
+        doneLists = {lid for lid, name in listNames.items() if name.strip().lower() in DONE_LIST_NAMES}
+
+        perList = {lid: {'id': lid, 'name': name, 'cards': 0, 'completed': 0, 'overdue': 0} for lid, name in listNames.items()}
+        perMember = {}
+        aging = dict.fromkeys(AGING_BUCKETS, 0)
+        unassigned, noDueDate = [], []
+        total = completed = overdue = 0
+
+        for card in cards or []:
+            total += 1
+            listStats = perList.setdefault(card['idList'], {'id': card['idList'], 'name': None, 'cards': 0, 'completed': 0, 'overdue': 0})
+            listStats['cards'] += 1
+
+            isDone = bool(card.get('dueComplete')) or card['idList'] in doneLists
+            isOverdue = False
+            if card.get('due'):
+                due = datetime.fromisoformat(card['due'].replace('Z', '+00:00'))
+                if not isDone and due < self.now:
+                    isOverdue = True
+                    aging[self._agingBucket(due)] += 1
+            elif not isDone:
+                noDueDate.append(card)
+
+            if isDone:
+                completed += 1
+                listStats['completed'] += 1
+            if isOverdue:
+                overdue += 1
+                listStats['overdue'] += 1
+
+            if not card.get('idMembers'):
+                if not isDone:
+                    unassigned.append(card)
+            for memberId in card.get('idMembers') or []:
+                memberStats = perMember.setdefault(memberId, {'id': memberId, 'fullName': memberNames.get(memberId), 'open': 0, 'completed': 0, 'overdue': 0})
+                memberStats['completed' if isDone else 'open'] += 1
+                if isOverdue:
+                    memberStats['overdue'] += 1
+
+        for stats in perList.values():
+            stats['completionRatio'] = _ratio(stats['completed'], stats['cards'])
+
+        return {
+            'board': board,
+            'generatedAt': self.now.isoformat(),
+            'totals': {
+                'cards': total,
+                'completed': completed,
+                'completionRatio': _ratio(completed, total),
+                'overdue': overdue,
+                'unassigned': len(unassigned),
+                'noDueDate': len(noDueDate),
+            },
+            'overdueAging': aging,
+            'lists': list(perList.values()),
+            # Most loaded members first
+            'members': sorted(perMember.values(), key=lambda m: (m['overdue'], m['open']), reverse=True),
+            'unassignedCards': [self._cardRef(c, listNames) for c in unassigned[:MAX_LISTED_CARDS]],
+            'noDueDateCards': [self._cardRef(c, listNames) for c in noDueDate[:MAX_LISTED_CARDS]],
+        }
+
+    def _cardRef(self, card, listNames):
+        return {'id': card['id'], 'name': card['name'], 'list': listNames.get(card['idList'])}
@@ -1,46 +1,96 @@
 from dotenv import load_dotenv
 from handlers import trello_handler
+from tools.board_analytics import BoardAnalytics
+from tools.result_cache import skipResultCache
+from connectors.executor import deadlineExpired, DeadlineExceeded
 
 class ToolsMethods:
     def __init__(self):
         load_dotenv()
         self.trello = trello_handler.TrelloHandler()
 
-    def boardDataForSummary(self, board_id):
+    def boardDataForSummary(self, board_id, includeCards=False):
         try:
             board = self.trello.handleGetBoardDetails(board_id)
             lists = self.trello.handleGetListForBoard(board_id)
             cards = self.trello.handleGetCardsForBoard(board_id)
+            members = self.trello.handleGetBoardMembers(board_id)
+
+            summary = BoardAnalytics().buildDigest(board, lists, cards, members)
+            if includeCards:
+                summary['cards'] = cards
+            # Sections that could not be fetched, so a failure never reads as an empty board
+            missing = [name for name, section in (('board', board), ('lists', lists), ('cards', cards), ('members', members)) if section is None]
+            summary['partial'] = bool(missing)
+            summary['missing'] = missing
+            if missing:
+                summary['error'] = "latency budget exhausted" if deadlineExpired() else "Trello API error"
+                skipResultCache()
+            if cards is None:
+                summary['totals'] = None
+                summary['overdueAging'] = None
 
             import json
-            return json.dumps({
-                'board': board,
-                'lists': lists,
-                'cards': cards
-            }, indent=2)
+            return json.dumps(summary, indent=2)
         except Exception as e:
             print(f"Error fetching board details: {e}")
             return None
 
     def getOverdueTaskWithMembers(self, board_id, dateLimit=None):
         try:
-            cards = self.trello.handleGetTaskOverdue(board_id, dateLimit)            
-            for card in cards:
-                member_details = []
-                for member_id in card.get('idMembers', []):
-                    member_info = self.trello.handleGetMemberDetails(member_id)
-                    if member_info:
-                        member_details.append(member_info)
-                card['memberDetails'] = member_details
+            cards = []
+            partial = False
+            try:
+                # Names come from the board's members (cached or prefetched); only members who are no
+                # longer on the board are looked up, each once
+                members = {m['id']: m for m in self.trello.handleGetBoardMembers(board_id) or []}
+                for card in self.trello.handleIterTaskOverdue(board_id, dateLimit):
+                    cards.append(card)
+                    if deadlineExpired():
+                        # Out of budget: the remaining cards are returned without member names
+                        partial = True
+                        continue
+                    member_details = []
+                    for member_id in card.get('idMembers', []):
+                        if member_id not in members:
+                            member = self.trello.handleGetMemberDetails(member_id)
+                            if member is None and deadlineExpired():
+                                # The lookup was cut short by the budget, not a missing member
+                                partial = True
+                                continue
+                            members[member_id] = member
+                        if members[member_id]:
+                            member_details.append(members[member_id])
+                    card['memberDetails'] = member_details
+            except DeadlineExceeded:
+                partial = True
+            if partial:
+                skipResultCache()
             import json
             return json.dumps({
                 'board_id': json.dumps(board_id, indent=2),
-                'overdue_cards': json.dumps(cards, indent=2)
+                'overdue_cards': json.dumps(cards, indent=2),
+                'partial': partial
             }, indent=2)
         except Exception as e:
             print(f"Error fetching overdue tasks: {e}")
             return None
         
+    def getBoardComments(self, board_id, card_id=None, since=None, before=None):
+        try:
+            comments = self.trello.handleGetBoardComments(board_id, card_id, since, before)
+            import json
+            return json.dumps(comments, indent=2)
+        except Exception as e:
+            print(f"Error fetching board comments: {e}")
+            return None
+
+    def getCardBoardId(self, card_id):
+        return self.trello.handleGetCardBoard(card_id)
+
+    def getListBoardId(self, list_id):
+        return self.trello.handleGetListBoard(list_id)
+
     def addCommentToCard(self, card_id, comment_text):
         try:
             response = self.trello.handleAddCommentToCard(card_id, comment_text)
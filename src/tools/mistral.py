@@ -1,7 +1,10 @@
 import os
 from mistralai import Mistral
 
+from connectors.executor import checkCancelled, httpTimeout
+
 from handlers import trello_handler
+from tools.prefetch import prefetcher
 
 class MistralAI:
     def __init__(self):
@@ -11,8 +14,10 @@ class MistralAI:
     def get_chat_response(self, user_message: str) -> str:
         api_key = os.getenv("MISTRAL_API_KEY")
         client = Mistral(api_key=api_key)
+        checkCancelled()
         response = client.chat.complete(
             model=self.model,
+            timeout_ms=int(httpTimeout()[1] * 1000),
             messages=[
                 {
                     "role": "user",
@@ -35,4 +40,7 @@ class MistralAI:
         Here is the JSON data:
         {allBoards}"""
 
-        return self.get_chat_response(prompt)
\ No newline at end of file
+        boardId = self.get_chat_response(prompt)
+        # Follow-up calls usually drill into the same board: start loading it now
+        prefetcher.speculate(boardId.strip() if boardId else None)
+        return boardId
\ No newline at end of file
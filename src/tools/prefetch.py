@@ -0,0 +1,89 @@
+import os
+import re
+import threading
+from connectors.executor import deadline, submitBackground, currentCall
+from handlers.trello_cache import boardCache
+from handlers.trello_handler import TrelloHandler
+from handlers.teams_handler import TeamsHandler
+from handlers.teams_directory import teamsDirectory
+
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "true").lower() == "true"
+# Time budget (seconds) of one speculative board prefetch, and of the startup warm-up
+PREFETCH_BUDGET = float(os.getenv("PREFETCH_BUDGET_SECONDS", "10"))
+WARMUP_BUDGET = float(os.getenv("WARMUP_BUDGET_SECONDS", "30"))
+
+BOARD_ID_RE = re.compile(r"^[0-9a-f]{24}$")
+
+
+class Prefetcher:
+    """
+    Loads data the next tool calls are likely to need before they ask for it:
+    boards, member directories and the Graph token at startup, and the cards,
+    lists and members of a board as soon as it is resolved.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._speculations = 0
+        self._skipped = 0
+
+    def warmUp(self):
+        if not PREFETCH_ENABLED:
+            return
+        with deadline(WARMUP_BUDGET):
+            try:
+                trello = TrelloHandler()
+                for board in trello.handleGetBoards() or []:
+                    trello.handleGetBoardMembers(board['id'], warm=True)
+            except Exception as e:
+                print(f"Error warming up Trello data: {e}")
+
+            try:
+                teams = TeamsHandler()
+                if teams.use_live:
+                    teams.api._get_token()
+                    if teams.team_id:
+                        teamsDirectory.teamMembers(teams.api, teams.team_id)
+            except Exception as e:
+                print(f"Error warming up Teams data: {e}")
+
+    def speculate(self, board_id):
+        """Prefetches a freshly resolved board in the background, within PREFETCH_BUDGET."""
+        if not PREFETCH_ENABLED or not board_id or not BOARD_ID_RE.match(board_id):
+            return
+        with self._lock:
+            if board_id in self._pending:
+                return
+            if all(boardCache.isWarm(board_id, section) for section in ('cards', 'lists', 'members')):
+                self._skipped += 1
+                return
+            self._pending.add(board_id)
+            self._speculations += 1
+        submitBackground('prefetch', self._prefetchBoard, board_id, currentCall())
+
+    def _prefetchBoard(self, board_id, origin=None):
+        try:
+            # Tagged with the call that resolved the board, so its own reads are not counted as hits
+            with deadline(PREFETCH_BUDGET, call=origin):
+                trello = TrelloHandler()
+                if not boardCache.isWarm(board_id, 'cards'):
+                    trello.handleGetCardsForBoard(board_id, warm=True)
+                if not boardCache.isWarm(board_id, 'lists'):
+                    trello.handleGetListForBoard(board_id, warm=True)
+                if not boardCache.isWarm(board_id, 'members'):
+                    trello.handleGetBoardMembers(board_id, warm=True)
+        except Exception as e:
+            print(f"Error prefetching board {board_id}: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(board_id)
+
+    def stats(self):
+        with self._lock:
+            stats = {'speculations': self._speculations, 'skippedAlreadyWarm': self._skipped}
+        stats.update(boardCache.prefetchStats())
+        return stats
+
+
+prefetcher = Prefetcher()
@@ -0,0 +1,165 @@
+import os
+import sys
+import time
+import functools
+import threading
+import contextlib
+import contextvars
+from datetime import datetime
+from connectors.executor import addJobHook
+
+# Profile every tool call, or only those sent with the profiling header
+PROFILE_ALL = os.getenv("MCP_PROFILE", "false").lower() == "true"
+PROFILE_HEADER = os.getenv("MCP_PROFILE_HEADER", "x-mcp-profile")
+PROFILE_DIR = os.getenv("MCP_PROFILE_DIR", "profiles")
+SAMPLE_INTERVAL = float(os.getenv("MCP_PROFILE_INTERVAL_MS", "5")) / 1000
+
+_session = contextvars.ContextVar('profile_session', default=None)
+
+
+class ProfileSession:
+    """Stack samples of the event loop and worker threads running one tool invocation."""
+
+    def __init__(self, name, loopThread, loopFrame):
+        self.name = name
+        self.threads = set()
+        # The loop thread is shared by every task: only its samples taken inside loopFrame belong here
+        self.loopThread = loopThread
+        self.loopFrame = loopFrame
+        self.stacks = {}
+        self.samples = 0
+        self.started = time.monotonic()
+
+
+class Sampler:
+    """
+    Wall-clock sampling profiler. A single background thread reads the stacks
+    of the threads tracked by the active sessions; threads blocked in a socket
+    read show up too, so connector waits are visible next to handler code.
+    The event loop thread is sampled while it runs the profiled call: the tool
+    coroutine, the result cache lookups and the JSON building done on the loop.
+    The MCP layer serializes the returned text after the call, outside the profile.
+    Nothing runs while no session is active.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions = set()
+        self._thread = None
+
+    def start(self, session):
+        with self._lock:
+            self._sessions.add(session)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="mcp-profiler", daemon=True)
+                self._thread.start()
+
+    def stop(self, session):
+        with self._lock:
+            self._sessions.discard(session)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                sessions = list(self._sessions)
+                if not sessions:
+                    self._thread = None
+                    return
+            frames = sys._current_frames()
+            for session in sessions:
+                for ident in list(session.threads):
+                    _record(session, frames.get(ident))
+                frame = frames.get(session.loopThread)
+                if _within(frame, session.loopFrame):
+                    _record(session, frame)
+            time.sleep(SAMPLE_INTERVAL)
+
+
+_sampler = Sampler()
+
+
+def _record(session, frame):
+    if frame is not None:
+        stack = _collapse(frame)
+        session.stacks[stack] = session.stacks.get(stack, 0) + 1
+        session.samples += 1
+
+
+def _within(frame, outer):
+    while frame is not None:
+        if frame is outer:
+            return True
+        frame = frame.f_back
+    return False
+
+
+def _collapse(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+@contextlib.contextmanager
+def _trackWorkerThread():
+    session = _session.get()
+    if session is None:
+        yield
+        return
+    ident = threading.get_ident()
+    session.threads.add(ident)
+    try:
+        yield
+    finally:
+        session.threads.discard(ident)
+
+
+def _requestedByHeader():
+    try:
+        from mcp.server.lowlevel.server import request_ctx
+        request = request_ctx.get().request
+        return request is not None and request.headers.get(PROFILE_HEADER, "").lower() in ("1", "true", "yes")
+    except (LookupError, AttributeError, ImportError):
+        return False
+
+
+def _writeProfile(session):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    path = os.path.join(PROFILE_DIR, f"{session.name}-{stamp}.folded")
+    # Folded stacks: one "frame;frame;frame count" line per stack (flamegraph.pl, speedscope)
+    with open(path, "w", encoding="utf-8") as f:
+        for stack, count in sorted(session.stacks.items()):
+            f.write(f"{stack} {count}\n")
+    elapsed = time.monotonic() - session.started
+    print(f"Profile of {session.name}: {elapsed:.2f}s, {session.samples} samples -> {path}")
+
+
+def profiled(tool):
+    """
+    Runs an async MCP tool under the sampling profiler when MCP_PROFILE or the
+    profiling header asks for it. Put it above @cachedResult so cache lookups are profiled too.
+    """
+
+    @functools.wraps(tool)
+    async def wrapper(*args, **kwargs):
+        if not (PROFILE_ALL or _requestedByHeader()):
+            return await tool(*args, **kwargs)
+
+        addJobHook(_trackWorkerThread)
+        session = ProfileSession(tool.__name__, threading.get_ident(), sys._getframe())
+        token = _session.set(session)
+        _sampler.start(session)
+        try:
+            return await tool(*args, **kwargs)
+        finally:
+            _sampler.stop(session)
+            _session.reset(token)
+            try:
+                _writeProfile(session)
+            except OSError as e:
+                print(f"Error writing profile: {e}")
+
+    return wrapper
@@ -0,0 +1,160 @@
+import json
+import time
+import functools
+import threading
+import contextvars
+from connectors.executor import runBlocking
+from connectors.shared_store import store
+
+# Arguments that change how a tool runs but not what it returns
+IGNORED_ARGS = ('budget_seconds',)
+
+# How long an invalidation stamp outlives the last entry of its tag (longer than any tool budget)
+STAMP_RETENTION = 600
+
+META_KEY = "result:meta"
+ENTRY_PREFIX = "result:entry:"
+
+_pending = contextvars.ContextVar('result_cache_pending', default=None)
+
+
+class ToolResultCache:
+    """
+    Results of read tools, keyed by tool name and normalized arguments.
+    Entries carry tags such as "cards:<board id>" so write tools can drop
+    exactly the results they affect. Entries and tags live in the shared
+    store, so a write handled by one server worker invalidates them for all.
+
+    Each invalidation takes a number from a sequence and stamps it on the
+    tags it drops; a result computed since sequence N is only refused when
+    one of its own tags was stamped after N.
+    """
+
+    def __init__(self, store=store):
+        self._store = store
+        self._lock = threading.Lock()
+        # Counters of this worker only
+        self._stats = {'hits': 0, 'misses': 0, 'invalidated': 0}
+
+    def _meta(self):
+        return self._store.transaction(META_KEY, lambda: {'sequence': 0, 'cleared': 0, 'tags': {}})
+
+    def _count(self, stat, n=1):
+        with self._lock:
+            self._stats[stat] += n
+
+    def makeKey(self, tool, args, caseInsensitive=()):
+        normalized = {}
+        for name, value in sorted(args.items()):
+            if name in IGNORED_ARGS:
+                continue
+            if isinstance(value, str):
+                value = " ".join(value.split())
+                if name in caseInsensitive:
+                    value = value.casefold()
+            normalized[name] = value
+        return f"{ENTRY_PREFIX}{tool}:{json.dumps(normalized, sort_keys=True, default=str)}"
+
+    def version(self):
+        """Point in the invalidation sequence to pass back to set()."""
+        with self._store.view(META_KEY) as meta:
+            return meta['sequence'] if meta else 0
+
+    def get(self, key):
+        with self._store.view(key) as value:
+            self._count('misses' if value is None else 'hits')
+            return value
+
+    def set(self, key, value, ttl, tags, version):
+        with self._meta() as meta:
+            # One of its tags was invalidated while the result was computed: it may already be stale
+            if meta['cleared'] > version or any(meta['tags'].get(tag, {}).get('invalidated', 0) > version for tag in tags):
+                return False
+            self._store.put(key, value, ttl)
+            self._pruneTags(meta)
+            for tag in tags:
+                meta['tags'].setdefault(tag, {'invalidated': 0, 'at': 0, 'keys': {}})['keys'][key] = time.time() + ttl
+            return True
+
+    def invalidate(self, *tags):
+        with self._meta() as meta:
+            meta['sequence'] += 1
+            for tag in tags:
+                entry = meta['tags'].setdefault(tag, {'invalidated': 0, 'at': 0, 'keys': {}})
+                entry['invalidated'] = meta['sequence']
+                entry['at'] = time.time()
+                for key in entry['keys']:
+                    self._store.delete(key)
+                    self._count('invalidated')
+                entry['keys'] = {}
+            self._pruneTags(meta)
+
+    def _pruneTags(self, meta):
+        """Forgets entries that expired on their own, and tags with nothing left to invalidate."""
+        now = time.time()
+        for tag, entry in list(meta['tags'].items()):
+            entry['keys'] = {key: expires for key, expires in entry['keys'].items() if expires > now}
+            if not entry['keys'] and now - entry['at'] > STAMP_RETENTION:
+                del meta['tags'][tag]
+
+    def clear(self):
+        with self._meta() as meta:
+            meta['sequence'] += 1
+            meta['cleared'] = meta['sequence']
+            meta['tags'] = {}
+            keys = self._store.keys(ENTRY_PREFIX)
+            for key in keys:
+                self._store.delete(key)
+            self._count('invalidated', len(keys))
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        return dict(stats, entries=len(self._store.keys(ENTRY_PREFIX)))
+
+
+resultCache = ToolResultCache()
+
+
+def cacheTags(*tags):
+    """Tags the result of the tool being computed, for later invalidation."""
+    pending = _pending.get()
+    if pending is not None:
+        pending['tags'].update(tags)
+
+
+def skipResultCache():
+    """Keeps the result of the tool being computed out of the cache (partial or failed)."""
+    pending = _pending.get()
+    if pending is not None:
+        pending['cacheable'] = False
+
+
+def cachedResult(ttl, caseInsensitive=()):
+    """Serves an async MCP tool from the result cache for `ttl` seconds."""
+
+    def decorator(tool):
+        @functools.wraps(tool)
+        async def wrapper(**kwargs):
+            key = resultCache.makeKey(tool.__name__, kwargs, caseInsensitive)
+            # The store may be SQLite shared with other workers: keep its I/O off the event loop
+            cached = await runBlocking('store', resultCache.get, key)
+            if cached is not None:
+                return cached
+
+            version = await runBlocking('store', resultCache.version)
+            # Shared (mutable) state, so tags set from worker threads are seen here too
+            pending = {'tags': set(), 'cacheable': True}
+            token = _pending.set(pending)
+            try:
+                result = await tool(**kwargs)
+            finally:
+                _pending.reset(token)
+
+            if pending['cacheable'] and result not in (None, "null"):
+                await runBlocking('store', resultCache.set, key, result, ttl, pending['tags'], version)
+            return result
+
+        return wrapper
+
+    return decorator